@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Benchmarks the hot paths of contract.py on the emulator: posting with
+# N posters per block or with the retention window full, the first
+# invocation of a block (rollover, credit settlement, expiry and pruning),
+# ticket purchases with M holders and geolocation queries over windows of
+# 1 to 500 blocks.
+#
+# Usage: ./benchmark.py [--quick] [--json results.json]
+
+import json
+import argparse
+
+from emulator import ContractEmulator, toInt
+
+PostsPerBlock = 10
+
+
+def address(i):
+    return b'%020d' % i
+
+
+class Scenario:
+    def __init__(self, nPosters=0, nHolders=1, retentionBlocks=None):
+        self.emulator = ContractEmulator()
+        if retentionBlocks is not None:
+            # keep more blocks than the contract does, e.g. for long queries
+            self.emulator.contract["RetentionBlocks"] = retentionBlocks
+        self.posters = [address(i) for i in range(1, nPosters + 1)]
+        self.holders = [address(-i) for i in range(1, nHolders + 1)]
+
+        emulator = self.emulator
+        emulator.addWitness(emulator.admin)
+        for addr in self.posters + self.holders:
+            emulator.addWitness(addr)
+
+        emulator.invoke("deploy")
+        emulator.nextBlock()
+        for addr in self.holders:
+            emulator.invoke("transferFromPool", [addr, 100000])
+            emulator.invoke("requestTicket", [addr, 1000])
+
+    def post(self, addr, i):
+        geolocation = "$%s_%s_0" % (i % 97, i % 89)
+        return self.emulator.invoke("postGeo", [addr, geolocation, 1000 + i, 1 + i % 4])
+
+    def fillBlock(self, postsPerPoster=1):
+        i = 0
+        for addr in self.posters:
+            for k in range(postsPerPoster):
+                self.post(addr, i)
+                i += 1
+
+    def invoke(self, method, args):
+        self.emulator.invoke(method, args)
+        return self.emulator.last
+
+
+def row(scenario, param, stats):
+    d = stats.toDict()
+    d["scenario"] = scenario
+    d["param"] = param
+    return d
+
+
+def average(scenario, param, method, stats):
+    d = row(scenario, param, stats[0])
+    for k in ("gets", "puts", "deletes", "bytesWritten", "notifications", "witnessChecks", "gas", "seconds"):
+        d[k] = sum(s.toDict()[k] for s in stats) / len(stats)
+    d["method"] = method
+    return d
+
+
+def benchPostGeo(sizes):
+    rows = []
+    for n in sizes:
+        s = Scenario(nPosters=n)
+        s.emulator.nextBlock()
+        s.invoke("prune", [])
+        stats = []
+        for (i, addr) in enumerate(s.posters):
+            s.post(addr, i)
+            stats.append(s.emulator.last)
+        rows.append(average("posters per block", n, "postGeo", stats))
+
+        # the first invocation of the next block settles the posted block
+        s.emulator.nextBlock()
+        stats = s.invoke("transfer", [s.holders[0], s.posters[0], 1])
+        rows.append(row("posters per block", n, stats))
+        rows[-1]["method"] = "transfer (rollover)"
+
+        # claiming is paid by each poster on its own
+        stats = s.invoke("claimRewards", [s.posters[-1]])
+        rows.append(row("posters per block", n, stats))
+
+    return rows
+
+
+def benchSteadyState(nBlocks):
+    # the same vehicles post in every block until the retention window is
+    # full, so each post also releases pending rewards and prunes a block
+    rows = []
+    s = Scenario(nPosters=PostsPerBlock)
+    for b in range(nBlocks):
+        s.emulator.nextBlock()
+        s.fillBlock()
+
+    s.emulator.nextBlock()
+    s.invoke("prune", [])
+    stats = []
+    for (i, addr) in enumerate(s.posters):
+        s.post(addr, i)
+        stats.append(s.emulator.last)
+    rows.append(average("blocks posted", nBlocks, "postGeo", stats))
+
+    return rows
+
+
+def benchPostGeoBatch(sizes):
+    rows = []
+    for n in sizes:
+        s = Scenario(nPosters=1)
+        s.emulator.nextBlock()
+        s.invoke("prune", [])
+        addr = s.posters[0]
+        samples = [["$%s_%s_0" % (i, i), 1000 + i, 1] for i in range(n)]
+        stats = s.invoke("postGeoBatch", [addr, samples])
+        rows.append(row("batch size", n, stats))
+
+    return rows
+
+
+def benchRequestTicket(holders, lengths):
+    rows = []
+    for m in holders:
+        s = Scenario(nPosters=PostsPerBlock, nHolders=m)
+        s.emulator.nextBlock()
+        s.fillBlock()
+        addr = address(10 ** 6)
+        s.emulator.addWitness(addr)
+        s.invoke("transferFromPool", [addr, 10 ** 6])
+        for n in lengths:
+            stats = s.invoke("requestTicket", [addr, n])
+            rows.append(row("ticket holders %s, nBlocks" % m, n, stats))
+
+        s.emulator.nextBlock()
+        stats = s.invoke("transfer", [s.holders[0], s.posters[0], 1])
+        rows.append(row("ticket holders %s" % m, m, stats))
+        rows[-1]["method"] = "transfer (rollover)"
+
+    return rows
+
+
+def benchRequestGeo(windows, nBlocks):
+    # every window reads its own blocks: nBlocks covers the largest one
+    # and the retention is raised to keep them
+    rows = []
+    s = Scenario(nPosters=PostsPerBlock, retentionBlocks=max(windows + [nBlocks]))
+    for b in range(nBlocks):
+        s.emulator.nextBlock()
+        s.fillBlock()
+
+    addr = s.holders[0]
+    for n in windows:
+        stats = s.invoke("requestGeo", [addr, n])
+        rows.append(row("query window", n, stats))
+
+        stats = s.invoke("requestGeoRegion", [addr, [1], n])
+        rows.append(row("query window", n, stats))
+
+    # an incremental sync only pays for the records after its cursor
+    b = toInt(s.emulator.get("block/NRC"))
+    stats = s.invoke("requestGeoFrom", [addr, b, 0])
+    rows.append(row("new records", PostsPerBlock, stats))
+
+    stats = s.invoke("requestLatest", [addr])
+    rows.append(row("active vehicles", len(s.posters), stats))
+
+    # the first invocation of a block with the retention window full
+    s.emulator.nextBlock()
+    stats = s.invoke("prune", [])
+    rows.append(row("blocks posted", nBlocks, stats))
+    rows[-1]["method"] = "prune (rollover)"
+
+    return rows
+
+
+def printTable(rows):
+    columns = ("scenario", "param", "method", "gets", "puts", "deletes",
+               "notifications", "gas", "seconds")
+    header = "%-28s %7s %-22s %8s %8s %8s %8s %9s %10s" % columns
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print("%-28s %7s %-22s %8.1f %8.1f %8.1f %8.1f %9.3f %8.1fus" % (
+            r["scenario"], r["param"], r["method"], r["gets"], r["puts"],
+            r["deletes"], r["notifications"], r["gas"], r["seconds"] * 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark contract.py on the emulator")
+    parser.add_argument("--quick", action="store_true", help="run the small sizes only")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.quick:
+        rows = benchPostGeo([1, 10, 100]) + \
+            benchSteadyState(120) + \
+            benchPostGeoBatch([1, 16]) + \
+            benchRequestTicket([1, 10], [1, 500]) + \
+            benchRequestGeo([1, 10], 20)
+    else:
+        rows = benchPostGeo([1, 10, 100, 1000]) + \
+            benchSteadyState(120) + \
+            benchPostGeoBatch([1, 16, 64]) + \
+            benchRequestTicket([1, 10, 100], [1, 10, 100, 500]) + \
+            benchRequestGeo([1, 10, 100, 500], 500)
+
+    printTable(rows)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
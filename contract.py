@@ -19,6 +19,17 @@ InitialSupply = 50000000
 MaximumSupply = 100000000
 GenerationPerBlock = 100
 FeePerBlock = 10
+MaxBatchSize = 64
+MaxTileLength = 4
+MaxRegionTiles = 16
+ActiveBlocks = 10
+MaxExpirePerBlock = 8
+RetentionBlocks = 100
+MaxPrunePerBlock = 16
+MaxSyncRecords = 500
+
+# one-byte lengths for PackGeolocation, concat() of the integer 0 is empty
+Lengths = b'\x00\x01\x02\x03\x04\x05\x06\x07\x08'
 
 OnTransfer = RegisterAction('transfer', 'addr_from', 'addr_to', 'amount')
 
@@ -31,9 +42,8 @@ def Main(method, args):
     if method == "deploy":
         return Deploy()
 
-    if not Grow():
-        return False
-
+    # read-only methods do not grow the supply or settle credit, this is
+    # deferred to the next state-changing invocation
     if method == "name":
         return Name
 
@@ -51,6 +61,9 @@ def Main(method, args):
         addr = args[0]
         return GetBalance(addr)
 
+    if not Grow():
+        return False
+
     if method == "transfer":
         addr_from = args[0]
         addr_to = args[1]
@@ -66,18 +79,49 @@ def Main(method, args):
         addr = args[0]
         geolocation = args[1]
         timestamp = args[2]
-        return PostGeolocation(addr, geolocation, timestamp)
+        tile = 0
+        if len(args) > 3:
+            tile = args[3]
+        return PostGeolocation(addr, geolocation, timestamp, tile)
+
+    if method == "postGeoBatch":
+        addr = args[0]
+        samples = args[1]
+        return PostGeolocationBatch(addr, samples)
 
     if method == "requestGeo":
         addr = args[0]
         nBlocks = args[1]
         return RequestGeolocations(addr, nBlocks)
 
+    if method == "requestGeoFrom":
+        addr = args[0]
+        fromBlock = args[1]
+        fromIndex = args[2]
+        return RequestGeolocationsFrom(addr, fromBlock, fromIndex)
+
+    if method == "requestGeoRegion":
+        addr = args[0]
+        tiles = args[1]
+        nBlocks = args[2]
+        return RequestGeolocationsInRegion(addr, tiles, nBlocks)
+
+    if method == "requestLatest":
+        addr = args[0]
+        return RequestLatestGeolocations(addr)
+
     if method == "requestTicket":
         addr = args[0]
         nBlocks = args[1]
         return RequestTicket(addr, nBlocks)
 
+    if method == "claimRewards":
+        addr = args[0]
+        return ClaimRewards(addr)
+
+    if method == "prune":
+        return Prune()
+
 
 def Deploy():
     print("********deploy()")
@@ -109,15 +153,31 @@ def IncBlk():
     Put(context, "block/height", height)
 
     SettleCredit()
+    ExpireVehicles(context, b)
+    PruneBlocks(context, b, MaxPrunePerBlock)
     return True
 
 
 def SettleCredit():
     print("********SettleCredit()")
     context = GetContext()
-    b = Get(context, "block/NRC") - 1
-    key = concat("credit/", b)
-    credit = Get(context, key)
+    t = Get(context, "block/NRC")
+    b = t - 1
+
+    # the credit of the previous block is the fee rate of the tickets
+    # active in it plus the rest credit carried from earlier blocks
+    rate = Get(context, "fee/rate")
+    carry = Get(context, "fee/carry")
+    credit = rate + carry
+
+    # tickets ending at the previous block stop paying from now on
+    key = concat("fee/expire/", t)
+    expire = Get(context, key)
+    if expire > 0:
+        rate = rate - expire
+        Put(context, "fee/rate", rate)
+        Delete(context, key)
+
     if credit == 0:
         return
 
@@ -125,10 +185,8 @@ def SettleCredit():
     cnt = Get(context, key)
     if cnt == 0:
         # accumulate the credit to the next block
-        t = b + 1
-        key = concat("credit/", t)
-        credit = Get(context, key) + credit
-        Put(context, key, credit)
+        if credit != carry:
+            Put(context, "fee/carry", credit)
         return
 
     # NEO VM does not support floating point
@@ -137,25 +195,16 @@ def SettleCredit():
     credit_left = credit - credit_m * cnt
     if credit_left > 0:
         # accumulate the rest credit to the next block
-        t = b + 1
-        key = concat("credit/", t)
-        credit = Get(context, key) + credit_left
-        Put(context, key, credit)
+        Put(context, "fee/carry", credit_left)
+    elif carry > 0:
+        Delete(context, "fee/carry")
 
     if credit_m == 0:
         return
 
-    # credit location-posters
-    i = 1
-    while i <= cnt:
-        key = Concat4(b, "/", i, "/addr")
-        addr = Get(context, key)
-
-        key = concat("balance/", addr)
-        balance = Get(context, key) + credit_m
-        Put(context, key, balance)
-        OnTransfer(0, addr, credit_m)
-        i = i + 1
+    # record the credit per post once, location-posters claim it lazily
+    key = concat("reward/", b)
+    Put(context, key, credit_m)
 
 
 def Grow():
@@ -184,12 +233,21 @@ def Grow():
     return True
 
 
-def PostGeolocation(addr, geolocation, timestamp):
+def PostGeolocation(addr, geolocation, timestamp, tile):
     print("********PostGeolocation")
     if len(addr) != 20:
         print("Invalid address!")
         return False
 
+    # PackGeolocation stores the length in one byte of Lengths
+    if timestamp <= 0 or len(timestamp) > 8:
+        print("Invalid timestamp!")
+        return False
+
+    if len(tile) > MaxTileLength:
+        print("Invalid tile!")
+        return False
+
     if not CheckWitness(addr):
         print("No privilege!")
         return False
@@ -201,18 +259,238 @@ def PostGeolocation(addr, geolocation, timestamp):
     cnt = Get(context, key) + 1
     Put(context, key, cnt)
 
-    key = Concat4(b, "/", cnt, "/ts")
-    Put(context, key, timestamp)
+    key = Concat3(b, "/", cnt)
+    record = PackGeolocation(addr, timestamp, tile, geolocation)
+    Put(context, key, record)
 
-    key = Concat4(b, "/", cnt, "/addr")
-    Put(context, key, addr)
+    if tile > 0:
+        AddToTile(context, tile, b, cnt)
 
-    key = Concat4(b, "/", cnt, "/geo")
-    Put(context, key, geolocation)
+    UpdateLatest(context, addr, b, record)
+    AddPendingPosts(context, addr, b, 1)
+
+    # every post prunes at least one stale record, so storage stays
+    # bounded however many posts a block takes
+    PruneBlocks(context, b, 2)
 
     return True
 
 
+# samples is an array of [geolocation, timestamp] or
+# [geolocation, timestamp, tile] entries
+def PostGeolocationBatch(addr, samples):
+    print("********PostGeolocationBatch")
+    if len(addr) != 20:
+        print("Invalid address!")
+        return False
+
+    n = len(samples)
+    if n == 0:
+        print("Empty batch!")
+        return False
+
+    if n > MaxBatchSize:
+        print("Batch too large!")
+        return False
+
+    # validate the whole batch before anything is stored
+    i = 0
+    while i < n:
+        sample = samples[i]
+        timestamp = sample[1]
+        if timestamp <= 0 or len(timestamp) > 8:
+            print("Invalid timestamp!")
+            return False
+
+        if len(sample) > 2:
+            tile = sample[2]
+            if len(tile) > MaxTileLength:
+                print("Invalid tile!")
+                return False
+        i = i + 1
+
+    if not CheckWitness(addr):
+        print("No privilege!")
+        return False
+
+    context = GetContext()
+    b = Get(context, "block/NRC")
+
+    key_cnt = concat(b, "/cnt")
+    cnt = Get(context, key_cnt)
+
+    i = 0
+    while i < n:
+        sample = samples[i]
+        geolocation = sample[0]
+        timestamp = sample[1]
+        tile = 0
+        if len(sample) > 2:
+            tile = sample[2]
+
+        cnt = cnt + 1
+        key = Concat3(b, "/", cnt)
+        record = PackGeolocation(addr, timestamp, tile, geolocation)
+        Put(context, key, record)
+
+        if tile > 0:
+            AddToTile(context, tile, b, cnt)
+        i = i + 1
+
+    Put(context, key_cnt, cnt)
+
+    # samples are in time order, the last one is the newest
+    UpdateLatest(context, addr, b, record)
+    AddPendingPosts(context, addr, b, n)
+    PruneBlocks(context, b, n + 1)
+
+    return True
+
+
+# posts of a tile are indexed under tile/<tile>/<block>/<j> by their
+# position in the block, the tile itself is computed by the poster
+def AddToTile(context, tile, b, i):
+    prefix = concat("tile/", tile)
+    prefix = Concat3(prefix, "/", b)
+
+    key = concat(prefix, "/cnt")
+    cnt = Get(context, key) + 1
+    Put(context, key, cnt)
+
+    key = Concat3(prefix, "/", cnt)
+    Put(context, key, i)
+
+
+# last/<addr> holds the block and the newest record of every vehicle
+# posted within the last ActiveBlocks blocks, active/1..active/cnt
+# enumerates these vehicles
+def UpdateLatest(context, addr, b, record):
+    key = concat("last/", addr)
+    value = Get(context, key)
+    blk = GetPackedBlock(value)
+
+    value = PackWithBlock(b, record)
+    Put(context, key, value)
+
+    if blk == 0:
+        cnt = Get(context, "active/cnt") + 1
+        Put(context, "active/cnt", cnt)
+        key = concat("active/", cnt)
+        Put(context, key, addr)
+
+
+# checks at most MaxExpirePerBlock active vehicles per block, walking the
+# set downwards from active/cursor and wrapping around
+def ExpireVehicles(context, b):
+    cnt = Get(context, "active/cnt")
+    n = MaxExpirePerBlock
+    if n > cnt:
+        n = cnt
+    if n == 0:
+        return
+
+    cnt0 = cnt
+    k0 = Get(context, "active/cursor")
+    k = k0
+    while n > 0:
+        n = n - 1
+        if k < 1:
+            k = cnt
+        if k > cnt:
+            k = cnt
+
+        key = concat("active/", k)
+        addr = Get(context, key)
+        key_last = concat("last/", addr)
+        value = Get(context, key_last)
+        blk = GetPackedBlock(value)
+        if blk + ActiveBlocks <= b:
+            # move the vehicle in the last slot into the free one
+            if k < cnt:
+                key_cnt = concat("active/", cnt)
+                moved = Get(context, key_cnt)
+                Put(context, key, moved)
+                key = key_cnt
+
+            Delete(context, key)
+            Delete(context, key_last)
+
+            cnt = cnt - 1
+            if cnt == 0:
+                n = 0
+
+        k = k - 1
+
+    # an idle rollover writes nothing
+    if cnt != cnt0:
+        Put(context, "active/cnt", cnt)
+    if k != k0:
+        Put(context, "active/cursor", k)
+
+
+# pending/<addr> holds the block of the last posts of a vehicle and
+# their count, until the reward of the block is settled
+def AddPendingPosts(context, addr, b, n):
+    key = concat("pending/", addr)
+    value = Get(context, key)
+    blk = GetPackedBlock(value)
+    cnt = n
+    if blk == b:
+        cnt = GetPackedData(value) + n
+
+    # posts of an earlier block are settled before tracking the new block
+    elif blk > 0:
+        SettleRewards(context, addr, blk, GetPackedData(value))
+
+    value = PackWithBlock(b, cnt)
+    Put(context, key, value)
+
+
+def SettleRewards(context, addr, blk, cnt):
+    key = concat("reward/", blk)
+    amount = Get(context, key) * cnt
+    if amount == 0:
+        return 0
+
+    key = concat("balance/", addr)
+    balance = Get(context, key) + amount
+    Put(context, key, balance)
+    OnTransfer(0, addr, amount)
+
+    return amount
+
+
+def ClaimRewards(addr):
+    print("********ClaimRewards()")
+    if not CheckWitness(addr):
+        print("No privilege!")
+        return False
+
+    context = GetContext()
+    b = Get(context, "block/NRC")
+
+    key = concat("pending/", addr)
+    value = Get(context, key)
+    blk = GetPackedBlock(value)
+    if blk == 0:
+        return 0
+
+    # the reward of the current block is not settled yet
+    if blk == b:
+        return 0
+
+    return ReleasePending(context, addr, value)
+
+
+def ReleasePending(context, addr, value):
+    key = concat("pending/", addr)
+    Delete(context, key)
+
+    blk = GetPackedBlock(value)
+    cnt = GetPackedData(value)
+    return SettleRewards(context, addr, blk, cnt)
+
+
 def GetBalance(addr):
     print("********GetBalance()")
     context = GetContext()
@@ -308,16 +586,23 @@ def RequestTicket(addr, nBlocks):
     Put(context, key, balance)
     OnTransfer(addr, 0, fee)
 
+    # the ticket pays FeePerBlock for blocks bl..br: it is added to the
+    # active fee rate now and removed again when block br + 1 begins
     bl = Get(context, "block/NRC")
     br = bl + nBlocks - 1
-    while bl <= br:
-        key = concat("credit/", bl)
-        Put(context, key, FeePerBlock)
-        bl = bl + 1
+
+    rate = Get(context, "fee/rate") + FeePerBlock
+    Put(context, "fee/rate", rate)
+
+    t = br + 1
+    key = concat("fee/expire/", t)
+    expire = Get(context, key) + FeePerBlock
+    Put(context, key, expire)
 
     # Register the user
     key = concat("ticket/", addr)
-    Put(context, key, br)
+    if Get(context, key) < br:
+        Put(context, key, br)
     print("User registered.")
 
     return True
@@ -337,13 +622,16 @@ def RequestGeolocations(addr, nBlocks):
     context = GetContext()
     b = Get(context, "block/NRC")
     fromBlock = b - nBlocks + 1
+
+    # older blocks may have been pruned already
+    oldest = b - RetentionBlocks + 1
+    if fromBlock < oldest:
+        fromBlock = oldest
+
     if fromBlock < 1:
         fromBlock = 1
 
-    # check if the user holds a valid ticket 
-    key = concat("ticket/", addr)
-    br = Get(context, key)
-    if br < b:
+    if not HasTicket(context, addr, b):
         print("User does not hold a valid ticket!")
         return False
 
@@ -354,25 +642,334 @@ def RequestGeolocations(addr, nBlocks):
 
         j = 1
         while j <= cnt:
-            key = Concat4(i, "/", j, "/ts")
-            timestamp = Get(context, key)
+            key = Concat3(i, "/", j)
+            record = Get(context, key)
+            payload = UnpackGeolocation(record)
+            Notify(payload)
 
-            key = Concat4(i, "/", j, "/addr")
-            addr = Get(context, key)
+            j = j + 1
 
-            key = Concat4(i, "/", j, "/geo")
-            geolocation = Get(context, key)
+        i = i + 1
+
+    return True
 
-            payload = [timestamp, addr, geolocation]
-            Notify(payload)
+
+# no need to actually invoke.
+# Notifies the records after post fromIndex of block fromBlock, at most
+# MaxSyncRecords of them, and then the cursor [block, index] of the last
+# record notified to resume from.
+def RequestGeolocationsFrom(addr, fromBlock, fromIndex):
+    print("********RequestGeolocationsFrom()")
+    if not CheckWitness(addr):
+        print("No privilege!")
+        return False
+
+    context = GetContext()
+    b = Get(context, "block/NRC")
+
+    if not HasTicket(context, addr, b):
+        print("User does not hold a valid ticket!")
+        return False
+
+    # older blocks may have been pruned already
+    oldest = b - RetentionBlocks + 1
+    if fromBlock < oldest:
+        fromBlock = oldest
+        fromIndex = 0
+
+    if fromBlock < 1:
+        fromBlock = 1
+        fromIndex = 0
+
+    i = fromBlock
+    j = fromIndex
+    n = 0
+    while i <= b:
+        key = concat(i, "/cnt")
+        cnt = Get(context, key)
+
+        while j < cnt:
+            if n == MaxSyncRecords:
+                Notify([i, j])
+                return True
 
             j = j + 1
+            key = Concat3(i, "/", j)
+            record = Get(context, key)
+            payload = UnpackGeolocation(record)
+            Notify(payload)
+            n = n + 1
+
+        # the current block may still receive posts
+        if i == b:
+            Notify([i, j])
+            return True
+
+        i = i + 1
+        j = 0
+
+    Notify([fromBlock, fromIndex])
+    return True
+
+
+# no need to actually invoke.
+def RequestGeolocationsInRegion(addr, tiles, nBlocks):
+    print("********RequestGeolocationsInRegion()")
+    if not CheckWitness(addr):
+        print("No privilege!")
+        return False
+
+    if nBlocks < 1:
+        print("Invalid nBlocks!")
+        return False
+
+    nTiles = len(tiles)
+    if nTiles == 0:
+        print("No tiles!")
+        return False
+
+    if nTiles > MaxRegionTiles:
+        print("Too many tiles!")
+        return False
+
+    context = GetContext()
+    b = Get(context, "block/NRC")
+    fromBlock = b - nBlocks + 1
+
+    # older blocks may have been pruned already
+    oldest = b - RetentionBlocks + 1
+    if fromBlock < oldest:
+        fromBlock = oldest
+
+    if fromBlock < 1:
+        fromBlock = 1
+
+    if not HasTicket(context, addr, b):
+        print("User does not hold a valid ticket!")
+        return False
+
+    i = fromBlock
+    while i <= b:
+        k = 0
+        while k < nTiles:
+            prefix = concat("tile/", tiles[k])
+            prefix = Concat3(prefix, "/", i)
+
+            key = concat(prefix, "/cnt")
+            cnt = Get(context, key)
+
+            j = 1
+            while j <= cnt:
+                key = Concat3(prefix, "/", j)
+                n = Get(context, key)
+
+                key = Concat3(i, "/", n)
+                record = Get(context, key)
+                payload = UnpackGeolocation(record)
+                Notify(payload)
+
+                j = j + 1
+
+            k = k + 1
 
         i = i + 1
 
     return True
 
 
+# no need to actually invoke.
+def RequestLatestGeolocations(addr):
+    print("********RequestLatestGeolocations()")
+    if not CheckWitness(addr):
+        print("No privilege!")
+        return False
+
+    context = GetContext()
+    b = Get(context, "block/NRC")
+
+    if not HasTicket(context, addr, b):
+        print("User does not hold a valid ticket!")
+        return False
+
+    cnt = Get(context, "active/cnt")
+    k = 1
+    while k <= cnt:
+        key = concat("active/", k)
+        vehicle = Get(context, key)
+
+        # skip vehicles which expired but were not swept yet
+        key = concat("last/", vehicle)
+        value = Get(context, key)
+        blk = GetPackedBlock(value)
+        if blk + ActiveBlocks > b:
+            record = GetPackedData(value)
+            payload = UnpackGeolocation(record)
+            Notify(payload)
+
+        k = k + 1
+
+    return True
+
+
+def HasTicket(context, addr, b):
+    # the ticket is valid up to and including block ticket/<addr>
+    key = concat("ticket/", addr)
+    br = Get(context, key)
+    return br >= b
+
+
+# A geolocation record is stored under a single key <block>/<i> as
+#   addr (20 bytes) | n (1 byte) | timestamp (n bytes) |
+#   m (1 byte) | tile (m bytes) | geolocation
+def PackGeolocation(addr, timestamp, tile, geolocation):
+    n = len(timestamp)
+    record = concat(addr, substr(Lengths, n, 1))
+    record = concat(record, timestamp)
+
+    m = len(tile)
+    record = concat(record, substr(Lengths, m, 1))
+    record = concat(record, tile)
+
+    record = concat(record, geolocation)
+    return record
+
+
+def UnpackGeolocation(record):
+    addr = substr(record, 0, 20)
+    n = substr(record, 20, 1)
+    timestamp = substr(record, 21, n)
+
+    i = 21 + n
+    m = substr(record, i, 1)
+    i = i + 1 + m
+    n = len(record) - i
+    geolocation = substr(record, i, n)
+
+    return [timestamp, addr, geolocation]
+
+
+def GetRecordTile(record):
+    n = substr(record, 20, 1)
+    i = 21 + n
+    m = substr(record, i, 1)
+    i = i + 1
+    return substr(record, i, m)
+
+
+# Values which carry the block they were written in, last/<addr> and
+# pending/<addr>, are stored as
+#   n (1 byte) | block (n bytes) | data
+def PackWithBlock(b, data):
+    n = len(b)
+    value = concat(substr(Lengths, n, 1), b)
+    value = concat(value, data)
+    return value
+
+
+def GetPackedBlock(value):
+    if len(value) == 0:
+        return 0
+
+    n = substr(value, 0, 1)
+    return substr(value, 1, n)
+
+
+def GetPackedData(value):
+    n = substr(value, 0, 1)
+    i = 1 + n
+    n = len(value) - i
+    return substr(value, i, n)
+
+
+def Prune():
+    print("********Prune()")
+    context = GetContext()
+    b = Get(context, "block/NRC")
+    PruneBlocks(context, b, MaxPrunePerBlock)
+    return True
+
+
+# Deletes the storage of blocks older than RetentionBlocks, at most
+# `steps` posts or empty blocks per call. The rollover prunes
+# MaxPrunePerBlock steps and each post one step more than it stores.
+# gc/block is the oldest block not yet pruned, its posts are pruned from
+# <block>/cnt downwards.
+def PruneBlocks(context, b, steps):
+    p0 = Get(context, "gc/block")
+    p = p0
+    if p == 0:
+        p = 1
+
+    # nothing is stale until the retention window is full
+    if p + RetentionBlocks > b:
+        return
+
+    key_cnt = concat(p, "/cnt")
+    cnt = Get(context, key_cnt)
+    posted = cnt > 0
+    pruned = False
+
+    while steps > 0:
+        steps = steps - 1
+        if p + RetentionBlocks > b:
+            steps = 0
+        elif cnt > 0:
+            PruneRecord(context, p, cnt)
+            cnt = cnt - 1
+            pruned = True
+
+        if cnt == 0:
+            if p + RetentionBlocks <= b:
+                if posted:
+                    Delete(context, key_cnt)
+                    key = concat("reward/", p)
+                    Delete(context, key)
+
+                p = p + 1
+                key_cnt = concat(p, "/cnt")
+                cnt = Get(context, key_cnt)
+                posted = cnt > 0
+                pruned = False
+
+    if pruned:
+        Put(context, key_cnt, cnt)
+
+    if p != p0:
+        Put(context, "gc/block", p)
+
+
+def PruneRecord(context, p, i):
+    key = Concat3(p, "/", i)
+    record = Get(context, key)
+    Delete(context, key)
+
+    # unclaimed rewards of the block are credited before reward/<p> goes
+    addr = substr(record, 0, 20)
+    key = concat("pending/", addr)
+    value = Get(context, key)
+    blk = GetPackedBlock(value)
+    if blk == p:
+        ReleasePending(context, addr, value)
+
+    # posts are pruned in reverse order, so the post is the last entry
+    # of its tile bucket
+    tile = GetRecordTile(record)
+    if tile > 0:
+        prefix = concat("tile/", tile)
+        prefix = Concat3(prefix, "/", p)
+
+        key_cnt = concat(prefix, "/cnt")
+        cnt = Get(context, key_cnt)
+        key = Concat3(prefix, "/", cnt)
+        Delete(context, key)
+
+        if cnt > 1:
+            cnt = cnt - 1
+            Put(context, key_cnt, cnt)
+        else:
+            Delete(context, key_cnt)
+
+
 def Concat3(a, b, c):
     s = concat(a, b)
     s = concat(s, c)
@@ -413,9 +1010,13 @@ def test():
     args = [addr_admin, "$123_456_789", 1234567891000]
     Test("postGeo", args)
 
-    args = [addr_admin, "$12_45_78", 1234567893000]
+    args = [addr_admin, "$12_45_78", 1234567893000, 5]
     Test("postGeo", args)
 
+    samples = [["$1_2_3", 1234567894000], ["$2_3_4", 1234567895000]]
+    args = [addr_admin, samples]
+    Test("postGeoBatch", args)
+
     args = [addr_admin, 5]
     Test("requestTicket", args)
 
@@ -423,6 +1024,18 @@ def test():
     args = [addr_admin, 1]
     Test("requestGeo", args)
 
+    addr_admin = b'#\xba\'\x03\xc52c\xe8\xd6\xe5"\xdc2 39\xdc\xd8\xee\xe9'
+    args = [addr_admin, [5], 1]
+    Test("requestGeoRegion", args)
+
+    addr_admin = b'#\xba\'\x03\xc52c\xe8\xd6\xe5"\xdc2 39\xdc\xd8\xee\xe9'
+    args = [addr_admin, 0, 0]
+    Test("requestGeoFrom", args)
+
+    addr_admin = b'#\xba\'\x03\xc52c\xe8\xd6\xe5"\xdc2 39\xdc\xd8\xee\xe9'
+    args = [addr_admin]
+    Test("requestLatest", args)
+
     addr_admin = b'#\xba\'\x03\xc52c\xe8\xd6\xe5"\xdc2 39\xdc\xd8\xee\xe9'
     args = [addr_admin]
     Test("balanceOf", args)
@@ -439,15 +1052,21 @@ def test():
     args = [addr_admin, 1]
     Test("requestGeo", args)
 
-    # Force grow
+    # Force grow, view methods leave it to the next invocation
     context = GetContext()
     Put(context, "block/height", -1)
     Test("symbol", args)
 
+    addr_admin = b'#\xba\'\x03\xc52c\xe8\xd6\xe5"\xdc2 39\xdc\xd8\xee\xe9'
+    args = [addr_admin]
+    Test("claimRewards", args)
+
     # Force grow
     context = GetContext()
     Put(context, "block/height", -1)
-    Test("name", args)
+    args = []
+    Test("prune", args)
+    Test("totalSupply", args)
 
     return True
 
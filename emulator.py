@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+
+# Runs contract.py directly in CPython without the boa compiler or a NEO
+# node. The boa.blockchain.vm.Neo.* interop APIs are replaced with a
+# dict-backed storage, a controllable block height and witness set, and
+# captured notifications. Every invocation counts its storage operations,
+# notifications and witness checks and estimates the GAS of these
+# syscalls with the NEO 2 prices (plain VM opcodes are not counted).
+#
+# Values follow the NEO VM conventions the contract relies on: integers
+# are stored as little-endian two's complement byte arrays, and byte
+# arrays read back from storage take part in arithmetic and comparisons
+# as integers.
+
+import os
+import ast
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulator", "lib"))
+from contractstorage import ContractReader, MemoryStorage, MaxSyncRecords
+
+ContractPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contract.py")
+
+# GAS per syscall, Storage.Put is charged per started KB of key + value
+PriceDefault = 0.001
+PriceGet = 0.1
+PricePutPerKB = 1.0
+PriceDelete = 0.1
+PriceCheckWitness = 0.2
+
+# addr_admin of the contract's test()
+TestAddress = b'#\xba\'\x03\xc52c\xe8\xd6\xe5"\xdc2 39\xdc\xd8\xee\xe9'
+
+
+def int2bytes(n):
+    if n == 0:
+        return b''
+    return n.to_bytes((n.bit_length() + 8) // 8, "little", signed=True)
+
+
+def toBytes(v):
+    if isinstance(v, bool):
+        return b'\x01' if v else b''
+    if isinstance(v, int):
+        return int2bytes(v)
+    if isinstance(v, str):
+        return v.encode("UTF-8")
+    return bytes(v)
+
+
+def toInt(v):
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, int):
+        return v
+    return int.from_bytes(toBytes(v), "little", signed=True)
+
+
+class ByteArray(bytes):
+    # arithmetic and ordering convert to integers like the NEO VM does
+
+    def __add__(self, other):
+        return toInt(self) + toInt(other)
+
+    def __radd__(self, other):
+        return toInt(other) + toInt(self)
+
+    def __sub__(self, other):
+        return toInt(self) - toInt(other)
+
+    def __rsub__(self, other):
+        return toInt(other) - toInt(self)
+
+    def __mul__(self, other):
+        return toInt(self) * toInt(other)
+
+    def __rmul__(self, other):
+        return toInt(other) * toInt(self)
+
+    def __lt__(self, other):
+        return toInt(self) < toInt(other)
+
+    def __le__(self, other):
+        return toInt(self) <= toInt(other)
+
+    def __gt__(self, other):
+        return toInt(self) > toInt(other)
+
+    def __ge__(self, other):
+        return toInt(self) >= toInt(other)
+
+    def __eq__(self, other):
+        if isinstance(other, int):
+            return toInt(self) == other
+        return bytes(self) == toBytes(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __bool__(self):
+        return toInt(self) != 0
+
+    __hash__ = bytes.__hash__
+
+
+def vmDiv(a, b):
+    # integer division truncating towards zero
+    (a, b) = (toInt(a), toInt(b))
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b >= 0) else -q
+
+
+def vmLen(v):
+    if isinstance(v, (list, tuple)):
+        return len(v)
+    return len(toBytes(v))
+
+
+def concat(a, b):
+    return ByteArray(toBytes(a) + toBytes(b))
+
+
+def substr(s, start, length):
+    start = toInt(start)
+    return ByteArray(toBytes(s)[start:start + toInt(length)])
+
+
+class DivTransformer(ast.NodeTransformer):
+    # `/` is integer division in the NEO VM
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Div):
+            return node
+
+        call = ast.Call(ast.Name("vmDiv", ast.Load()), [node.left, node.right], [])
+        return ast.copy_location(call, node)
+
+
+class CallStats:
+    def __init__(self, method):
+        self.method = method
+        self.gets = 0
+        self.puts = 0
+        self.deletes = 0
+        self.bytesWritten = 0
+        self.notifications = 0
+        self.witnessChecks = 0
+        self.gas = 0.
+        self.seconds = 0.
+
+    def storageOps(self):
+        return self.gets + self.puts + self.deletes
+
+    def toDict(self):
+        return {
+            "method": self.method,
+            "gets": self.gets,
+            "puts": self.puts,
+            "deletes": self.deletes,
+            "bytesWritten": self.bytesWritten,
+            "notifications": self.notifications,
+            "witnessChecks": self.witnessChecks,
+            "gas": round(self.gas, 3),
+            "seconds": self.seconds
+        }
+
+
+class Storage:
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.data = {}
+
+    def get(self, key):
+        stats = self.emulator.stats
+        stats.gets += 1
+        stats.gas += PriceGet
+        return ByteArray(self.data.get(toBytes(key), b''))
+
+    def put(self, key, value):
+        (key, value) = (toBytes(key), toBytes(value))
+        size = len(key) + len(value)
+        stats = self.emulator.stats
+        stats.puts += 1
+        stats.bytesWritten += size
+        stats.gas += ((size - 1) // 1024 + 1) * PricePutPerKB
+        self.data[key] = value
+
+    def delete(self, key):
+        stats = self.emulator.stats
+        stats.deletes += 1
+        stats.gas += PriceDelete
+        self.data.pop(toBytes(key), None)
+
+    def size(self):
+        return sum(len(k) + len(v) for (k, v) in self.data.items())
+
+
+class ContractEmulator:
+    def __init__(self, path=ContractPath, verbose=False):
+        self.verbose = verbose
+        self.height = 0
+        self.witnesses = set()
+        self.storage = Storage(self)
+        self.notifications = []
+        self.events = []
+        self.logs = []
+        self.stats = CallStats(None)
+        self.last = self.stats
+
+        self.modules = self.buildModules()
+        self.contract = self.load(path)
+        self.admin = bytes(self.contract["ADMIN"])
+
+
+    def buildModules(self):
+        def module(name, **attrs):
+            m = types.ModuleType(name)
+            m.__dict__.update(attrs)
+            return m
+
+        modules = {}
+        for name in ("boa", "boa.blockchain", "boa.blockchain.vm",
+                     "boa.blockchain.vm.Neo", "boa.blockchain.vm.System"):
+            modules[name] = module(name)
+
+        neo = "boa.blockchain.vm.Neo."
+        modules[neo + "Runtime"] = module(neo + "Runtime",
+            Notify=self.notify, GetTrigger=lambda: 0x10,
+            CheckWitness=self.checkWitness, Log=self.log)
+        modules[neo + "Action"] = module(neo + "Action",
+            RegisterAction=self.registerAction)
+        modules[neo + "TriggerType"] = module(neo + "TriggerType",
+            Application=0x10, Verification=0x00)
+        modules[neo + "TransactionType"] = module(neo + "TransactionType",
+            InvocationTransaction=0xd1)
+        modules[neo + "Transaction"] = module(neo + "Transaction", __all__=[])
+        modules[neo + "Output"] = module(neo + "Output",
+            GetScriptHash=None, GetValue=None, GetAssetId=None)
+        modules[neo + "Storage"] = module(neo + "Storage",
+            GetContext=self.getContext,
+            Get=lambda context, key: context.get(key),
+            Put=lambda context, key, value: context.put(key, value),
+            Delete=lambda context, key: context.delete(key))
+        modules[neo + "Blockchain"] = module(neo + "Blockchain",
+            GetHeight=self.getHeight)
+
+        system = "boa.blockchain.vm.System."
+        modules[system + "ExecutionEngine"] = module(system + "ExecutionEngine",
+            GetScriptContainer=None, GetExecutingScriptHash=None)
+
+        return modules
+
+
+    def load(self, path):
+        source = open(path).read()
+        tree = DivTransformer().visit(ast.parse(source, path))
+        tree = ast.fix_missing_locations(tree)
+
+        def importer(name, globals=None, locals=None, fromlist=(), level=0):
+            if name in self.modules:
+                return self.modules[name]
+            return __import__(name, globals, locals, fromlist, level)
+
+        builtins = dict(__builtins__ if isinstance(__builtins__, dict) else vars(__builtins__))
+        builtins.update({
+            "__import__": importer,
+            "print": self.log,
+            "len": vmLen
+        })
+
+        namespace = {
+            "__name__": "contract",
+            "__builtins__": builtins,
+            "concat": concat,
+            "substr": substr,
+            "vmDiv": vmDiv
+        }
+        exec(compile(tree, path, "exec"), namespace)
+        return namespace
+
+
+    # interop services
+
+    def getContext(self):
+        self.stats.gas += PriceDefault
+        return self.storage
+
+
+    def getHeight(self):
+        self.stats.gas += PriceDefault
+        return self.height
+
+
+    def checkWitness(self, addr):
+        self.stats.witnessChecks += 1
+        self.stats.gas += PriceCheckWitness
+        return toBytes(addr) in self.witnesses
+
+
+    def notify(self, payload):
+        self.stats.notifications += 1
+        self.stats.gas += PriceDefault
+        self.notifications.append(payload)
+
+
+    def registerAction(self, name, *params):
+        def action(*args):
+            self.stats.notifications += 1
+            self.stats.gas += PriceDefault
+            self.events.append((name, list(args)))
+        return action
+
+
+    def log(self, *args):
+        msg = " ".join(a.decode("UTF-8", "backslashreplace") if isinstance(a, bytes)
+                       else str(a) for a in args)
+        self.logs.append(msg)
+        if self.verbose:
+            print(msg)
+
+
+    # control
+
+    def addWitness(self, addr):
+        self.witnesses.add(toBytes(addr))
+
+
+    def nextBlock(self, n=1):
+        self.height += n
+
+
+    def invoke(self, method, args=None):
+        if args is None:
+            args = []
+
+        self.stats = CallStats(method)
+        t0 = time.perf_counter()
+        ret = self.contract["Main"](method, args)
+        self.stats.seconds = time.perf_counter() - t0
+        self.last = self.stats
+        return ret
+
+
+    def get(self, key):
+        return ByteArray(self.storage.data.get(toBytes(key), b''))
+
+
+def check(path=ContractPath):
+    # regression checks of the rewards, tickets, expiry and pruning
+    e = ContractEmulator(path)
+    e.addWitness(e.admin)
+    (a, b, c) = (b'a' * 20, b'b' * 20, b'c' * 20)
+    for addr in (a, b, c):
+        e.addWitness(addr)
+    blockNRC = lambda: toInt(e.get("block/NRC"))
+    reward = lambda blk: toInt(e.get(b"reward/" + toBytes(blk)))
+    balance = lambda addr: toInt(e.invoke("balanceOf", [addr]))
+
+    def rollover(n):
+        # the contract counts a block per height with an invocation
+        for i in range(n):
+            e.nextBlock()
+            e.invoke("prune")
+
+    assert e.invoke("deploy")
+    e.nextBlock()
+    assert e.invoke("transferFromPool", [c, 1000])
+    assert blockNRC() == 1
+
+    # a ticket of 5 blocks costs FeePerBlock per block
+    assert e.invoke("requestTicket", [c, 5])
+    assert balance(c) == 950
+    assert not e.invoke("requestTicket", [c, 0])
+
+    for i in range(3):
+        assert e.invoke("postGeo", [a, "$1_2_3", 1000 + i, 5])
+    assert e.invoke("postGeo", [b, "$1_2_3", 1000, 6])
+    assert not e.invoke("postGeo", [a, "$1_2_3", 2 ** 70])
+    assert not e.invoke("postGeoBatch", [a, [["$1_2_3", 1000], ["$1_2_3", 2 ** 70]]])
+    assert toInt(e.get(b"\x01/cnt")) == 4
+
+    # block 1 credits the fee of 10 to its 4 posts, 2 each and 2 carried
+    e.nextBlock()
+    assert e.invoke("claimRewards", [a]) == 6 and balance(a) == 6
+    assert e.invoke("claimRewards", [a]) == 0
+    assert reward(1) == 2 and toInt(e.get("fee/carry")) == 2
+
+    # b's pending reward is settled by its next post
+    assert e.invoke("postGeo", [b, "$1_2_3", 2000, 6])
+    assert balance(b) == 2
+
+    # the ticket is valid up to block 5, the fee rate drops after it
+    e.notifications = []
+    assert e.invoke("requestGeo", [c, 10])
+    assert len(e.notifications) == 5
+    assert e.invoke("requestGeoRegion", [c, [6], 10])
+    rollover(4)
+    assert blockNRC() == 6
+    assert not e.invoke("requestGeo", [c, 1])
+    assert toInt(e.get("fee/rate")) == 0
+
+    # a and b expire ActiveBlocks blocks after their last post
+    assert len(e.get(b"last/" + a)) > 0
+    rollover(10)
+    assert blockNRC() == 16
+    assert toInt(e.get("active/cnt")) == 0
+    assert len(e.get(b"last/" + a)) == 0 and len(e.get(b"last/" + b)) == 0
+
+    # blocks older than RetentionBlocks are pruned, unclaimed rewards of
+    # a pruned block are credited first: b's post in block 2 earned 12
+    assert reward(2) == 12
+    rollover(e.contract["RetentionBlocks"])
+    assert len(e.get(b"\x01/cnt")) == 0 and len(e.get(b"\x02/\x01")) == 0
+    assert reward(1) == 0 and reward(2) == 0
+    assert balance(b) == 14
+    assert not any(k.startswith(b"tile/") or k.startswith(b"pending/") for k in e.storage.data)
+    assert toInt(e.get("gc/block")) == blockNRC() - e.contract["RetentionBlocks"] + 1
+
+    # an idle rollover writes the block, height, supply and pool, and
+    # gc/block moves past the block that left the window
+    rollover(1)
+    assert e.last.puts == 5, e.last.toDict()
+
+    # ContractReader reads the same records and cursors as requestGeoFrom,
+    # across the retention window and the MaxSyncRecords limit
+    assert e.invoke("transferFromPool", [c, 10000])
+    assert e.invoke("requestTicket", [c, 500])
+    for i in range(150):
+        rollover(1)
+        samples = [["$%s_%s_0" % (i, j), 1000 + j, j % 3] for j in range(i % 13)]
+        e.invoke("postGeoBatch", [a, samples])
+
+    reader = ContractReader(MemoryStorage(e.storage.data))
+    b = blockNRC()
+    capped = False
+    cursors = [(0, 0), (1, 0), (b - 100, 2), (b - 60, 3), (b - 1, 100), (b, 0), (b + 5, 1)]
+    while len(cursors) > 0:
+        (block, index) = cursors.pop()
+        e.notifications = []
+        assert e.invoke("requestGeoFrom", [c, block, index])
+        records = [[bytes(v) for v in p] for p in e.notifications[:-1]]
+        cursor = tuple(toInt(v) for v in e.notifications[-1])
+        assert reader.readFrom(block, index) == (records, cursor), (block, index)
+
+        # follow a sync cut at MaxSyncRecords to its end
+        if len(records) == MaxSyncRecords:
+            cursors.append(cursor)
+            capped = True
+
+    assert capped
+    print("Regression checks passed.")
+
+
+if __name__ == "__main__":
+    # run the contract's own test() with the admin and the address it
+    # posts from as witnesses, then the regression checks
+    path = sys.argv[1] if len(sys.argv) > 1 else ContractPath
+    emulator = ContractEmulator(path, verbose=True)
+    emulator.addWitness(emulator.admin)
+    emulator.addWitness(TestAddress)
+    emulator.invoke("test")
+    print("Storage: %s keys, %s bytes" % (len(emulator.storage.data), emulator.storage.size()))
+    check(path)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# One NEO node hosting the sender and the receiver roles.
+#
+# NRCSender.py and NRCReceiver.py each open their own chain database and
+# run their own P2P node, reactor and PersistBlocks loop. NRCNode syncs
+# the chain once and hosts any number of sender and receiver wallets on
+# it: the senders' posting API on port 35001, where a request may name
+# the "wallet" address to post with, and one query API per receiver from
+# port 35002 on.
+#
+# Usage: ./lib/NRCNode.py [--sender WALLET]... [--receiver WALLET]...
+
+import sys
+import signal
+import asyncio
+import argparse
+from threading import Thread
+
+from neo.Settings import settings
+from neo.Core.Blockchain import Blockchain
+from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import LevelDBBlockchain
+from neo.Network.NodeLeader import NodeLeader
+from twisted.internet import reactor, task
+
+from NRCSender import NRCSender, serve as serveSenders
+from NRCReceiver import NRCReceiver, ReceiverServer, setDefaultReceiver
+
+
+class NRCNode:
+    def __init__(self, config):
+        settings.setup(config)
+        blockchain = LevelDBBlockchain(settings.LEVELDB_PATH)
+        Blockchain.RegisterBlockchain(blockchain)
+        self.senders = []
+        self.receivers = []
+
+
+    def addSender(self, walletPath, walletPwd):
+        sender = NRCSender(walletPath, walletPwd)
+        sender.startPosting()
+        self.senders.append(sender)
+        return sender
+
+
+    def addReceiver(self, walletPath, walletPwd):
+        receiver = NRCReceiver(walletPath, walletPwd)
+        if len(self.receivers) == 0:
+            setDefaultReceiver(receiver)
+        self.receivers.append(receiver)
+        return receiver
+
+
+    def sync_wallets(self):
+        for role in self.senders + self.receivers:
+            role.sync_wallet()
+
+
+    def quit(self):
+        print("Shutting down...")
+        Blockchain.Default().Dispose()
+        reactor.stop()
+        NodeLeader.Instance().Shutdown()
+
+
+    def run(self):
+        # the only chain sync, every wallet processes the same blocks
+        dbloop = task.LoopingCall(Blockchain.Default().PersistBlocks)
+        dbloop.start(0.1)
+        NodeLeader.Instance().Start()
+        reactor.suggestThreadPoolSize(15)
+        reactor.run(installSignalHandlers=False)
+
+
+    def runBackground(self):
+        t = Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+
+    def serve(self, host="127.0.0.1", senderPort=35001, receiverPort=35002):
+        if len(self.senders) > 0:
+            t = Thread(target=serveSenders, args=(self.senders, host, senderPort))
+            t.daemon = True
+            t.start()
+
+        # the receivers' servers share one event loop
+        servers = []
+        for (i, receiver) in enumerate(self.receivers):
+            server = ReceiverServer(receiver, host, receiverPort + i)
+            server.start()
+            servers.append(server)
+
+        try:
+            asyncio.get_event_loop().run_forever()
+        finally:
+            for server in servers:
+                server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the sender and receiver roles on one node")
+    parser.add_argument("--config", default="configs/sender/protocol.json")
+    parser.add_argument("--sender", action="append", help="sender wallet, may be repeated")
+    parser.add_argument("--receiver", action="append", help="receiver wallet, may be repeated")
+    parser.add_argument("--password", default="nrc123456*")
+    args = parser.parse_args()
+
+    senders = args.sender or ["configs/sender/wallet.db"]
+    receivers = args.receiver or ["configs/receiver/wallet.db"]
+
+    node = NRCNode(args.config)
+    for wallet in senders:
+        node.addSender(wallet, args.password)
+    for (i, wallet) in enumerate(receivers):
+        receiver = node.addReceiver(wallet, args.password)
+        receiver.useStorageReader()
+        receiver.useCache("configs/receiver/geocache.bin" if i == 0 else
+                          "configs/receiver/geocache-%s.bin" % i)
+
+    def signalHandler(signal, frame):
+        node.quit()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signalHandler)
+
+    node.runBackground()
+    node.sync_wallets()
+    node.serve()
@@ -2,16 +2,14 @@
 
 import sys
 import time
-import struct
 import signal
 import logging
 import json
-from socket import *
-from base58 import b58encode
-from threading import Thread
+import asyncio
+from threading import Thread, RLock, local
+from concurrent.futures import ThreadPoolExecutor
 
 from neo.Settings import settings
-from neocore.Cryptography.Crypto import Crypto
 from neo.Core.Blockchain import Blockchain
 from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import LevelDBBlockchain
 from neo.Implementations.Wallets.peewee.UserWallet import UserWallet
@@ -20,23 +18,56 @@ from neo.Prompt.Commands.Invoke import InvokeContract, TestInvokeContract
 from neo.contrib.smartcontract import SmartContract
 from twisted.internet import reactor, task
 
-contract_address = "3c6a0ee4cecadfd6d3fd06fd7e7eedfa6d57dfe1"
+import wire
+from invocation import InvocationCache, Address
+import payloads
+from geocodec import Decoder
+from walletsync import WalletSync
+from geotile import tilesAround
+from geostore import GeoStore
+from geocache import GeoCache
+from contractstorage import ContractReader, LevelDBStorage
+
+contract_address = "884af270aaa179303aa8d7210194a5290e3286aa"
+
+# must match contract.py
+MaxRegionTiles = 16
+
 smart_contract = SmartContract(contract_address)
+
+# the receiver running a test invocation on this thread
+invoking = local()
     
 @smart_contract.on_notify
 def sc_notify(event):
-    global receiver
+    # test invocations notify on the invoking thread, so with several
+    # receivers in one node each gets the events of its own requests
+    target = getattr(invoking, "receiver", None) or receiver
+    if target is None:
+        return
+
+    # requestGeoFrom ends with the [block, index] cursor to resume from
+    if len(event.event_payload) == 2:
+        target.setCursor(event.event_payload)
+        return
 
     if len(event.event_payload) != 3:
         return
 
-    receiver.addGeo(event.event_payload)
+    target.addGeo(event.event_payload)
 
 
 class NRCReceiver:
     def __init__(self, walletPath, walletPwd):
         self.open_wallet(walletPath, walletPwd)
-        self.geolocations = []
+        self.lock = RLock()
+        self.geolocations = GeoStore()
+        self.tiles = None
+        self.cursor = (0, 0)
+        self.reader = None
+        self.cache = None
+        self.decoder = Decoder()
+        self.listeners = []
 
 
     def open_wallet(self, path, pwd):
@@ -44,6 +75,8 @@ class NRCReceiver:
             self.Wallet = UserWallet.Open(path, pwd)
             self._walletdb_loop = task.LoopingCall(self.Wallet.ProcessBlocks)
             self._walletdb_loop.start(1)
+            self.walletSync = WalletSync(self.Wallet)
+            self.invocations = InvocationCache(self.Wallet, contract_address)
             print("Wallet %s is opened successfully!" % path)
         except Exception as e:
             print("Could not open wallet: %s" % e)
@@ -51,7 +84,31 @@ class NRCReceiver:
 
 
     def rebuild_wallet(self):
-        self.Wallet.Rebuild()
+        self.walletSync.rebuild()
+
+
+    def sync_wallet(self):
+        self.walletSync.sync()
+
+
+    def useStorageReader(self, storage=None):
+        # read geolocations from the contract storage instead of the VM
+        if storage is None:
+            storage = LevelDBStorage(contract_address)
+        self.reader = ContractReader(storage)
+
+
+    def useCache(self, path):
+        # restores the ingested records and the cursor saved on disk, and
+        # saves them from now on
+        self.cache = GeoCache(path)
+        with self.lock:
+            since = time.time() - self.geolocations.maxAge
+            for record in self.cache.load(since):
+                self.geolocations.add(record)
+            self.cursor = self.cache.cursor
+
+        print("Restored %s geolocations, resuming from block %s" % (len(self.geolocations), self.cursor[0]))
 
 
     def wait_contract(self):
@@ -67,16 +124,10 @@ class NRCReceiver:
             time.sleep(1)
 
 
-    def scriptHashToAddrStr(self, h):
-        d = chr(settings.ADDRESS_VERSION).encode("UTF-8") + h
-        checksum = Crypto.Default().Hash256(d)[:4]
-        return b58encode(d + checksum)
-
-
-    def bytes2timestamp(self, ts):
-        bytes8 = ts + b'\x00' * (8 - len(ts))
-        ts = struct.unpack('Q', bytes8)[0] / 1000.
-        return ts
+    def bytes2int(self, n):
+        if isinstance(n, int):
+            return n
+        return int.from_bytes(n, "little", signed=True)
 
 
     def test_invoke_contract(self, method, args=None):
@@ -87,7 +138,11 @@ class NRCReceiver:
         if args is not None:
             arguments.extend(args)
 
-        (tx, fee, results, num_ops) = TestInvokeContract(self.Wallet, arguments)
+        invoking.receiver = self
+        try:
+            (tx, fee, results, num_ops) = TestInvokeContract(self.Wallet, arguments)
+        finally:
+            invoking.receiver = None
         if tx is None or results is None:
             return False
 
@@ -107,55 +162,130 @@ class NRCReceiver:
         print("[%s] Progress: %s/%s" % (settings.net_name, \
             Blockchain.Default().Height, Blockchain.Default().HeaderHeight))
 
-        self.geolocations = []
-        args = ['["%s",%s]' % (self.Wallet.Addresses[0], 10)]
-        ret = self.test_invoke_contract("requestGeo", args)
-        if ret is False:
-            print("Failed to request geolocations!")
+        addr = self.Wallet.Addresses[0]
+        if self.tiles is None and self.reader is not None:
+            try:
+                self.readGeolocations(addr)
+                return
+            except Exception as e:
+                print("Could not read contract storage: %s" % e)
+
+        if self.tiles is None:
+            # only fetch the records after the ingested cursor, a call
+            # returns at most MaxSyncRecords of them and notifies the
+            # cursor to resume from, so a receiver behind takes several
+            while True:
+                (block, index) = self.cursor
+                args = ['["%s",%s,%s]' % (addr, block, index)]
+                ret = self.test_invoke_contract("requestGeoFrom", args)
+                if ret is False:
+                    print("Failed to request geolocations!")
+                    return
+
+                if self.cursor == (block, index):
+                    return
+
+        # region queries return the last 10 blocks, the store drops the
+        # records it already holds; a large region takes several queries
+        tiles = self.tiles
+        for i in range(0, len(tiles), MaxRegionTiles):
+            args = ['["%s",%s,%s]' % (addr, tiles[i:i + MaxRegionTiles], 10)]
+            ret = self.test_invoke_contract("requestGeoRegion", args)
+            if ret is False:
+                print("Failed to request geolocations!")
+                return
+
+
+    def readGeolocations(self, addr):
+        script_hash = self.Wallet.ToScriptHash(addr).Data
+        if not self.reader.hasTicket(script_hash):
+            print("User does not hold a valid ticket!")
             return
 
+        while True:
+            (block, index) = self.cursor
+            (records, cursor) = self.reader.readFrom(block, index)
+            self.addGeos(records)
+
+            self.updateCursor(cursor)
+            if len(records) == 0 or cursor == (block, index):
+                break
+
+
+    def setCursor(self, payload):
+        [block, index] = payload
+        self.updateCursor((self.bytes2int(block), self.bytes2int(index)))
+
+
+    def updateCursor(self, cursor):
+        # only called once the records before the cursor are added
+        with self.lock:
+            self.cursor = cursor
+            if self.cache is not None:
+                self.cache.setCursor(cursor)
+
+
+    def setRegion(self, x, y, radius):
+        # only request the tiles covering the region from now on
+        with self.lock:
+            if radius is None:
+                self.tiles = None
+            else:
+                self.tiles = tilesAround(x, y, radius)
+
+            # records outside the region may have been ingested already
+            self.geolocations.clear()
+            self.cursor = (0, 0)
+            if self.cache is not None:
+                self.cache.clear()
+
 
     def addGeo(self, payload):
-        [ts, sh, geo] = payload
-        ts = self.bytes2timestamp(ts)
-        receiver = self.scriptHashToAddrStr(sh)
-        (x, y, z) = map(float, geo.decode("UTF-8").replace("$", "").split("_"))
-        self.geolocations.append({
-            "timestamp": ts, 
-            "receiver": receiver, 
-            "location": (x, y, z)
-        })
+        self.addGeos([payload])
+
+
+    def addGeos(self, batch):
+        with self.lock:
+            records = payloads.decodeAll(batch, settings.ADDRESS_VERSION, self.decoder)
+            records = [r for r in records if self.geolocations.add(r)]
+            if self.cache is not None:
+                self.cache.append(records)
+
+        for record in records:
+            for listener in self.listeners:
+                listener(record)
+
+
+    def addListener(self, listener):
+        # listener(record) is called for every newly ingested record
+        self.listeners.append(listener)
 
 
     def getGeolocations(self, since):
         self.updateGeolocations()
+        return self.queryGeolocations(since)
 
-        geolocs = []
-        for loc in self.geolocations:
-            if loc["timestamp"] >= since:
-                geolocs.append(loc)
 
-        return geolocs
+    def chainHeight(self):
+        return Blockchain.Default().Height
+
+
+    def queryGeolocations(self, since, near=None, bbox=None):
+        # answers from the ingested records only, near = [x, y, radius]
+        # and bbox = [x0, y0, x1, y1] select vehicles by latest position
+        with self.lock:
+            self.geolocations.evict(time.time())
+            return self.geolocations.query(since, near, bbox)
 
 
     def requestTicket(self, nBlocks):
         addr = self.Wallet.Addresses[0]
-        args = ['["%s",%s]' % (addr, nBlocks)]
-        ret = self.test_invoke_contract("requestTicket", args)
-        if ret is False:
+        if not self.invocations.invoke("requestTicket", [Address(addr), nBlocks]):
             print("Failed to request ticket!")
             return False
 
-        (tx, fee, results) = ret
-        if not results[0].GetBoolean():
-            print("Invoke failed!")
-            return False
-
-        if self.invoke_contract(tx, fee):
-            print("Ticket requested successfully!")
-            return True
-
-        return False
+        print("Ticket requested successfully!")
+        return True
 
 
     def quit(self):
@@ -181,6 +311,12 @@ class NRCReceiver:
 
 receiver = None
 
+def setDefaultReceiver(r):
+    # gets the notifications not raised by a receiver's own invocation
+    global receiver
+    receiver = r
+
+
 def createReceiver(config, wallet, pwd):
     global receiver
 
@@ -199,38 +335,199 @@ def createReceiver(config, wallet, pwd):
     return receiver
 
 
+class ReceiverServer:
+    # Serves the socket API with asyncio. Chain invocations run on a
+    # bounded executor, the geolocations are synced in the background
+    # whenever a block is persisted, queries are answered from the
+    # in-memory store and subscribers get new records pushed.
+
+    def __init__(self, receiver, host="127.0.0.1", port=35002, workers=2, syncInterval=0.1):
+        self.receiver = receiver
+        self.address = (host, port)
+        self.syncInterval = syncInterval
+        self.chain = ThreadPoolExecutor(max_workers=workers)
+        self.syncer = ThreadPoolExecutor(max_workers=1)
+        self.loop = asyncio.get_event_loop()
+        self.subscribers = []
+
+        receiver.addListener(lambda record: self.loop.call_soon_threadsafe(self.publish, record))
+
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                (request, framed) = await wire.readRequest(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                print("Invalid data!")
+                return
+
+            if request.get("method") == "subscribe":
+                await self.subscribe(request, reader, writer, framed)
+                return
+
+            response = await self.dispatch(request)
+            if response is not None:
+                writer.write(self.encode(response, framed))
+                await writer.drain()
+        except Exception as e:
+            print("Request failed: %s" % e)
+        finally:
+            writer.close()
+
+
+    async def dispatch(self, request):
+        method = request.get("method")
+        if method == "requestTicket":
+            nBlocks = request["nBlocks"]
+            r = await self.loop.run_in_executor(self.chain, self.receiver.requestTicket, nBlocks)
+            self.loop.run_in_executor(self.chain, self.receiver.sync_wallet)
+            return {"ok": r}
+        elif method == "rebuildWallet":
+            await self.loop.run_in_executor(self.chain, self.receiver.rebuild_wallet)
+            return {"ok": True}
+        elif method == "setRegion":
+            self.receiver.setRegion(request.get("x"), request.get("y"), request.get("radius"))
+            return {"ok": True}
+        elif method == "requestGeolocations":
+            since = request["since"]
+            return self.receiver.queryGeolocations(since, request.get("near"), request.get("bbox"))
+
+        print("Unknown method: %s" % method)
+        return None
+
+
+    def encode(self, response, framed):
+        if framed:
+            return wire.encode(response)
+        return json.dumps(response).encode("UTF-8")
+
+
+    async def subscribe(self, request, reader, writer, framed):
+        # Pushes every newly ingested record matching the filter until the
+        # client disconnects, as geolocation frames or, for a bare JSON
+        # client, as lines of JSON. Records since `since` are sent first.
+        queue = asyncio.Queue(maxsize=1024)
+        subscriber = (queue, request)
+        self.subscribers.append(subscriber)
+        closed = None
+        try:
+            since = request.get("since")
+            if since is not None:
+                records = self.receiver.queryGeolocations(since, request.get("near"), request.get("bbox"))
+                records = [r for r in records if self.matches(r, request)]
+                self.push(writer, records, framed)
+
+            # the client closing its end ends the subscription
+            closed = self.loop.create_task(reader.read())
+            while True:
+                await writer.drain()
+                get = self.loop.create_task(queue.get())
+                await asyncio.wait([get, closed], return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    break
+
+                # records queued meanwhile go out in the same frame
+                records = [get.result()]
+                while not queue.empty():
+                    records.append(queue.get_nowait())
+                self.push(writer, records, framed)
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.remove(subscriber)
+            if closed is not None:
+                if not closed.done():
+                    closed.cancel()
+                elif not closed.cancelled():
+                    # a reset connection ends the read with an error
+                    closed.exception()
+
+
+    def push(self, writer, records, framed):
+        if len(records) == 0:
+            return
+
+        if framed:
+            writer.write(wire.encode(records))
+        else:
+            writer.write(b''.join((json.dumps(r) + "\n").encode("UTF-8") for r in records))
+
+
+    def matches(self, record, request):
+        sender = request.get("sender")
+        if sender is not None and record["receiver"] != sender:
+            return False
+
+        (x, y, z) = record["location"]
+        bbox = request.get("bbox")
+        if bbox is not None:
+            (x0, y0, x1, y1) = bbox
+            if not (x0 <= x <= x1 and y0 <= y <= y1):
+                return False
+
+        near = request.get("near")
+        if near is not None:
+            (cx, cy, radius) = near
+            if (x - cx) ** 2 + (y - cy) ** 2 > radius ** 2:
+                return False
+
+        return True
+
+
+    def publish(self, record):
+        for (queue, request) in self.subscribers:
+            if not self.matches(record, request):
+                continue
+
+            try:
+                queue.put_nowait(record)
+            except asyncio.QueueFull:
+                print("Subscriber too slow, record dropped!")
+
+
+    async def sync(self):
+        # syncs as soon as a new block is persisted
+        height = None
+        while True:
+            try:
+                h = self.receiver.chainHeight()
+                if h != height:
+                    await self.loop.run_in_executor(self.syncer, self.receiver.updateGeolocations)
+                    height = h
+            except Exception as e:
+                print("Failed to sync geolocations: %s" % e)
+
+            await asyncio.sleep(self.syncInterval)
+
+
+    def start(self):
+        (host, port) = self.address
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+        self.loop.create_task(self.sync())
+
+
+    def stop(self):
+        self.server.close()
+        self.chain.shutdown(wait=False)
+        self.syncer.shutdown(wait=False)
+
+
+    def serve(self):
+        self.start()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.stop()
+
+
 if __name__ == "__main__":
     config = "configs/receiver/protocol.json"
     wallet = "configs/receiver/wallet.db"
     passwd = "nrc123456*"
     receiver = createReceiver(config, wallet, passwd)
-    receiver.rebuild_wallet()
-
-    sfd = socket(AF_INET, SOCK_STREAM)
-    sfd.bind(("127.0.0.1", 35002))
-    sfd.listen(16)
-
-    while True:
-        s, addr = sfd.accept()
-        data = s.recv(1024).decode("UTF-8")
-        try:
-            data = json.loads(data)
-        except:
-            print("Invalid data!")
-            s.close()
-            continue
-
-        if data["method"] == "requestTicket":
-            nBlocks = data["nBlocks"]
-            r = receiver.requestTicket(nBlocks)
-            msg = json.dumps({"ok": r}).encode("UTF-8")
-            s.send(msg)
-        elif data["method"] == "requestGeolocations":
-            since = data["since"]
-            geos = receiver.getGeolocations(since)
-            msg = json.dumps(geos).encode("UTF-8")
-            s.send(msg)
-
-        s.close()
-        receiver.rebuild_wallet()
+    receiver.useStorageReader()
+    receiver.useCache("configs/receiver/geocache.bin")
+    receiver.sync_wallet()
 
+    ReceiverServer(receiver).serve()
@@ -5,11 +5,12 @@ import time
 import struct
 import signal
 import logging
+import json
 from prompt_toolkit import prompt
 from prompt_toolkit.token import Token
 from base58 import b58encode
-from threading import Thread
-import json
+from threading import Thread, Lock
+from queue import Queue, Empty
 from socket import *
 
 from neo.Settings import settings
@@ -22,12 +23,46 @@ from neo.Prompt.Commands.Invoke import InvokeContract, TestInvokeContract
 from neo.contrib.smartcontract import SmartContract
 from twisted.internet import reactor, task
 
-contract_address = "3c6a0ee4cecadfd6d3fd06fd7e7eedfa6d57dfe1"
+import wire
+from invocation import InvocationCache, Address
+from walletsync import WalletSync
+from geotile import tileOf
+from policy import DeadReckoning
+from geocodec import Encoder
+
+contract_address = "884af270aaa179303aa8d7210194a5290e3286aa"
+
+# must match contract.py
+MaxBatchSize = 64
+
+# longest wait for a block before the queued samples are posted anyway
+BlockInterval = 15
+
+# samples are posted once receivers' prediction is off by PositionError,
+# or after HeartbeatInterval seconds
+PositionError = 0.5
+HeartbeatInterval = 30.
+
+# geolocations are posted as fixed-point frames with GeoDigits decimals,
+# as deltas to the previous post if DeltaEncoding is set
+GeoDigits = 3
+DeltaEncoding = False
     
 class NRCSender:
     def __init__(self, walletPath, walletPwd):
         self.open_wallet(walletPath, walletPwd)
         self.geolocations = []
+        self.queue = Queue()
+        self.policy = DeadReckoning(PositionError, HeartbeatInterval)
+        self.encoder = Encoder(GeoDigits, DeltaEncoding)
+        self.statsLock = Lock()
+        self.stats = {
+            "posted": 0,
+            "failed": 0,
+            "submissions": 0,
+            "latency": 0.,
+            "maxLatency": 0.
+        }
 
 
     def open_wallet(self, path, pwd):
@@ -35,6 +70,8 @@ class NRCSender:
             self.Wallet = UserWallet.Open(path, pwd)
             self._walletdb_loop = task.LoopingCall(self.Wallet.ProcessBlocks)
             self._walletdb_loop.start(1)
+            self.walletSync = WalletSync(self.Wallet)
+            self.invocations = InvocationCache(self.Wallet, contract_address)
             print("Wallet %s is opened successfully!" % path)
         except Exception as e:
             print("Could not open wallet: %s" % e)
@@ -42,7 +79,11 @@ class NRCSender:
 
 
     def rebuild_wallet(self):
-        self.Wallet.Rebuild()
+        self.walletSync.rebuild()
+
+
+    def sync_wallet(self):
+        self.walletSync.sync()
 
 
     def wait_contract(self):
@@ -82,22 +123,131 @@ class NRCSender:
 
 
     def postGeolocation(self, ts, x, y, z):
-        geoloc = "$%s_%s_%s" % (x, y, z)
+        geoloc = self.encoder.encode(x, y, z)
+        tile = tileOf(float(x), float(y))
         addr = self.Wallet.Addresses[0]
+        samples = [(ts, x, y, z)]
+        onResult = lambda success: self.onPosted(samples, success)
         ts = int(ts * 1000)
-        args = ['["%s","%s",%s]' % (addr, geoloc, ts)]
-        ret = self.test_invoke_contract("postGeo", args)
-        if ret is False:
+        if not self.invocations.invoke("postGeo", [Address(addr), geoloc, ts, tile], onResult=onResult):
             print("Failed to post geolocation!")
-            return
+            self.rollback()
+            return False
+
+        print("Geolocation relayed successfully!")
+        return True
+
+
+    def postGeolocations(self, samples):
+        # posts samples of (ts, x, y, z) with one postGeoBatch invocation
+        if len(samples) == 1:
+            return self.postGeolocation(*samples[0])
+
+        addr = self.Wallet.Addresses[0]
+        entries = []
+        for (ts, x, y, z) in samples:
+            tile = tileOf(float(x), float(y))
+            entries.append([self.encoder.encode(x, y, z), int(ts * 1000), tile])
+
+        # the cost depends on the number of samples
+        onResult = lambda success: self.onPosted(samples, success)
+        if not self.invocations.invoke("postGeoBatch", [Address(addr), entries], len(samples), onResult):
+            print("Failed to post geolocations!")
+            self.rollback()
+            return False
+
+        print("%s geolocations relayed successfully!" % len(samples))
+        return True
+
+
+    def onPosted(self, samples, success):
+        # called once a relayed post was executed on chain
+        with self.statsLock:
+            self.stats["posted" if success else "failed"] += len(samples)
+        if not success:
+            print("Failed to post %s geolocations on chain!" % len(samples))
+            self.rollback()
+
+
+    def rollback(self):
+        # receivers did not get the post: the next delta needs a new base
+        # and the policy's history of what they got is wrong
+        self.encoder.reset()
+        with self.statsLock:
+            self.policy.reset()
+
+
+    def submitGeolocation(self, ts, x, y, z):
+        # queues the sample if receivers cannot predict it
+        with self.statsLock:
+            post = self.policy.offer(ts, float(x), float(y))
+        if post:
+            self.enqueueGeolocation(ts, x, y, z)
+        return post
+
+
+    def enqueueGeolocation(self, ts, x, y, z):
+        # returns at once, the posting thread submits the sample
+        self.queue.put((time.time(), (ts, x, y, z)))
+
+
+    def nextBatch(self):
+        # waits for a sample, then takes the samples arriving until the
+        # next block is persisted
+        batch = [self.queue.get()]
+        height = Blockchain.Default().Height
+        deadline = time.time() + BlockInterval
+        while len(batch) < MaxBatchSize:
+            timeout = deadline - time.time()
+            if timeout <= 0 or Blockchain.Default().Height != height:
+                break
 
-        (tx, fee, results) = ret
-        if not results[0].GetBoolean():
-            print("Invoke failed!")
-            return
+            try:
+                batch.append(self.queue.get(timeout=min(timeout, 0.1)))
+            except Empty:
+                pass
+
+        return batch
+
+
+    def postLoop(self):
+        while True:
+            batch = self.nextBatch()
+            ok = False
+            try:
+                ok = self.postGeolocations([sample for (t, sample) in batch])
+                self.sync_wallet()
+            except Exception as e:
+                print("Failed to post geolocations: %s" % e)
+                if not ok:
+                    self.rollback()
+
+            # from the oldest sample being queued to the submission,
+            # relayed samples are counted by onPosted
+            latency = time.time() - batch[0][0]
+            with self.statsLock:
+                if not ok:
+                    self.stats["failed"] += len(batch)
+                self.stats["submissions"] += 1
+                self.stats["latency"] = latency
+                self.stats["maxLatency"] = max(self.stats["maxLatency"], latency)
+
+            print("Submitted %s samples in %.2fs, queue depth %s" % (len(batch), latency, self.queue.qsize()))
+
+
+    def startPosting(self):
+        t = Thread(target=self.postLoop)
+        t.daemon = True
+        t.start()
 
-        if self.invoke_contract(tx, fee):
-            print("Geolocation posted successfully!")
+
+    def getStats(self):
+        with self.statsLock:
+            stats = dict(self.stats)
+            stats.update(self.policy.getStats())
+        stats["queueDepth"] = self.queue.qsize()
+        stats.update(self.invocations.getStats())
+        return stats
 
 
     def get_bottom_toolbar(self, cli=None):
@@ -130,9 +280,12 @@ class NRCSender:
                 x = args[0]
                 y = args[1]
                 z = args[2]
-                self.postGeolocation(time.time(), x, y, z)
+                if not self.submitGeolocation(time.time(), x, y, z):
+                    print("Skipped, receivers already predict this position")
             elif len(args) == 1 and args[0] == "rebuild":
-                self.Wallet.Rebuild()
+                self.rebuild_wallet()
+            elif len(args) == 1 and args[0] == "stats":
+                print(self.getStats())
             else:
                 print("Format should be: x y z")
 
@@ -175,31 +328,67 @@ def createSender(config, wallet, pwd):
 
     signal.signal(signal.SIGINT, signalHandler)
     sender.runBackground()
+    sender.startPosting()
     return sender
 
 
-if __name__ == "__main__":
-    config = "configs/sender/protocol.json"
-    wallet = "configs/sender/wallet.db"
-    passwd = "nrc123456*"
-    sender = createSender(config, wallet, passwd)
+def serve(senders, host="127.0.0.1", port=35001):
+    # posting API, a request may name the "wallet" address to post with,
+    # the "stats" and "rebuildWallet" methods act on that sender
+    wallets = dict((sender.Wallet.Addresses[0], sender) for sender in senders)
 
     sfd = socket(AF_INET, SOCK_STREAM)
-    sfd.bind(("127.0.0.1", 35001))
+    sfd.bind((host, port))
     sfd.listen(10)
 
     while True:
         s, addr = sfd.accept()
-        data = s.recv(1024).decode("UTF-8")
-        s.close()
         try:
-            d = json.loads(data)
-        except:
+            (d, framed) = wire.recvRequest(s)
+            # the first sender posts unless a wallet is named
+            wallet = d.get("wallet")
+            if wallet is None:
+                sender = senders[0]
+            elif wallet in wallets:
+                sender = wallets[wallet]
+            else:
+                print("Unknown wallet %s!" % wallet)
+                continue
+
+            method = d.get("method")
+            if method == "stats":
+                reply(s, sender.getStats(), framed)
+                continue
+            elif method == "rebuildWallet":
+                sender.rebuild_wallet()
+                reply(s, {"ok": True}, framed)
+                continue
+            elif method is not None:
+                print("Unknown method: %s" % method)
+                continue
+
+            sample = (d["timestamp"], d["x"], d["y"], d["z"])
+        except (ValueError, KeyError, TypeError, AttributeError, ConnectionError):
             print("Invalid data!")
             continue
+        finally:
+            s.close()
+
+        # queued samples are posted in the background
+        sender.submitGeolocation(*sample)
+
 
-        timestamp = d["timestamp"]
-        (x, y, z) = [d[k] for k in ("x", "y", "z")]
-        sender.postGeolocation(timestamp, x, y, z)
-        sender.rebuild_wallet()
+def reply(s, response, framed):
+    if framed:
+        wire.send(s, response)
+    else:
+        s.sendall(json.dumps(response).encode("UTF-8"))
+
+
+if __name__ == "__main__":
+    config = "configs/sender/protocol.json"
+    wallet = "configs/sender/wallet.db"
+    passwd = "nrc123456*"
+    sender = createSender(config, wallet, passwd)
 
+    serve([sender])
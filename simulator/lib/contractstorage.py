@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Reads the NRC contract's storage directly instead of running it in the
+# VM through TestInvokeContract. Keys and values are encoded the way the
+# NEO VM stores them, and records are unpacked with the layout of
+# PackGeolocation() in contract.py.
+#
+# The LevelDB backend reads the local node's blockchain state, the memory
+# backend wraps a plain dict of key -> value (e.g. the emulator storage).
+
+# must match contract.py
+RetentionBlocks = 100
+MaxSyncRecords = 500
+
+
+def vmint(n):
+    if n == 0:
+        return b''
+    return n.to_bytes((n.bit_length() + 8) // 8, "little", signed=True)
+
+
+def vmbytes(v):
+    if isinstance(v, int):
+        return vmint(v)
+    if isinstance(v, str):
+        return v.encode("UTF-8")
+    return bytes(v)
+
+
+def bytes2int(b):
+    return int.from_bytes(b, "little", signed=True)
+
+
+def key(*parts):
+    return b''.join(vmbytes(p) for p in parts)
+
+
+class MemoryStorage:
+    def __init__(self, data=None):
+        self.data = {} if data is None else data
+
+    def get(self, k):
+        return self.data.get(k, b'')
+
+    def put(self, k, v):
+        self.data[k] = vmbytes(v)
+
+
+class LevelDBStorage:
+    def __init__(self, contract_address):
+        from neo.Core.Blockchain import Blockchain
+        from neo.Core.State.StorageKey import StorageKey
+        from neocore.UInt160 import UInt160
+
+        self.blockchain = Blockchain.Default()
+        self.StorageKey = StorageKey
+        self.script_hash = UInt160.ParseString(contract_address)
+
+    def get(self, k):
+        storage_key = self.StorageKey(script_hash=self.script_hash, key=k)
+        item = self.blockchain.GetStorageItem(storage_key)
+        if item is None:
+            return b''
+        return bytes(item.Value)
+
+
+class ContractReader:
+    def __init__(self, storage):
+        self.storage = storage
+
+
+    def getInt(self, k):
+        return bytes2int(self.storage.get(k))
+
+
+    def currentBlock(self):
+        return self.getInt(b"block/NRC")
+
+
+    def hasTicket(self, addr):
+        return self.getInt(key("ticket/", addr)) >= self.currentBlock()
+
+
+    def unpack(self, record):
+        # addr (20) | n | timestamp (n) | m | tile (m) | geolocation
+        addr = record[:20]
+        n = record[20]
+        ts = record[21:21 + n]
+        i = 21 + n
+        m = record[i]
+        geo = record[i + 1 + m:]
+        return [ts, addr, geo]
+
+
+    def readFrom(self, block, index, limit=MaxSyncRecords):
+        # same records and cursor as requestGeoFrom
+        b = self.currentBlock()
+        oldest = max(b - RetentionBlocks + 1, 1)
+        if block < oldest:
+            (block, index) = (oldest, 0)
+
+        records = []
+        while block <= b:
+            cnt = self.getInt(key(block, "/cnt"))
+            while index < cnt:
+                if len(records) == limit:
+                    return (records, (block, index))
+
+                index += 1
+                record = self.storage.get(key(block, "/", index))
+                records.append(self.unpack(record))
+
+            if block == b:
+                break
+
+            block += 1
+            index = 0
+
+        return (records, (block, index))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# On-disk cache of the ingested geolocations and the sync cursor, so a
+# restarted receiver serves queries at once and resumes syncing where it
+# stopped.
+#
+# The file is a 64-byte header followed by fixed-size records:
+#
+#   header: magic | version | record size | block | index | count
+#   record: timestamp | x | y | z (doubles) | n | receiver (n bytes, padded)
+#
+# Records are only appended, then the header is rewritten with the new
+# count and cursor, so bytes past `count` records left by a crash are
+# ignored. Records are read through a memory map. Once the file holds
+# maxRecords records the newest half is kept and the rest compacted away.
+
+import os
+import mmap
+import struct
+
+Magic = b"NRCGEO\x00\x00"
+Version = 1
+Header = struct.Struct("<8sIIqqq")
+HeaderSize = 64
+AddressSize = 39
+Record = struct.Struct("<4dB%ds" % AddressSize)
+
+
+class GeoCache:
+    def __init__(self, path, maxRecords=200000):
+        self.path = path
+        self.maxRecords = maxRecords
+        self.cursor = (0, 0)
+        self.count = 0
+        self.open()
+
+
+    def open(self):
+        exists = os.path.exists(self.path)
+        self.f = open(self.path, "r+b" if exists else "w+b")
+        if exists and os.path.getsize(self.path) >= HeaderSize:
+            (magic, version, size, block, index, count) = Header.unpack(self.f.read(Header.size))
+            if magic == Magic and version == Version and size == Record.size:
+                self.cursor = (block, index)
+                self.count = count
+            else:
+                print("Geolocation cache %s is incompatible, starting over" % self.path)
+
+        # drop the records appended after the last header update
+        self.f.truncate(HeaderSize + self.count * Record.size)
+        self.writeHeader()
+
+
+    def close(self):
+        self.f.close()
+
+
+    def writeHeader(self):
+        (block, index) = self.cursor
+        header = Header.pack(Magic, Version, Record.size, block, index, self.count)
+        self.f.seek(0)
+        self.f.write(header.ljust(HeaderSize, b'\x00'))
+        self.f.flush()
+
+
+    def pack(self, record):
+        (x, y, z) = record["location"]
+        receiver = record["receiver"]
+        if isinstance(receiver, str):
+            receiver = receiver.encode("UTF-8")
+        if len(receiver) > AddressSize:
+            raise ValueError("Address too long: %s" % receiver)
+        return Record.pack(record["timestamp"], x, y, z, len(receiver), receiver)
+
+
+    def unpack(self, data, offset):
+        (ts, x, y, z, n, receiver) = Record.unpack_from(data, offset)
+        return {
+            "timestamp": ts,
+            "receiver": receiver[:n].decode("UTF-8"),
+            "location": (x, y, z)
+        }
+
+
+    def load(self, since=None, start=0):
+        # records from the start-th on, newer than since if given
+        if self.count <= start:
+            return []
+
+        records = []
+        with mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for i in range(start, self.count):
+                record = self.unpack(m, HeaderSize + i * Record.size)
+                if since is None or record["timestamp"] >= since:
+                    records.append(record)
+
+        return records
+
+
+    def append(self, records, cursor=None):
+        if len(records) > 0:
+            self.f.seek(HeaderSize + self.count * Record.size)
+            self.f.write(b''.join(self.pack(r) for r in records))
+            self.count += len(records)
+
+        if cursor is not None:
+            self.cursor = cursor
+        self.writeHeader()
+
+        if self.count >= self.maxRecords:
+            self.compact(self.count - self.maxRecords // 2)
+
+
+    def setCursor(self, cursor):
+        self.cursor = cursor
+        self.writeHeader()
+
+
+    def compact(self, start):
+        # keeps the records from the start-th on
+        records = self.load(start=start)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            (block, index) = self.cursor
+            header = Header.pack(Magic, Version, Record.size, block, index, len(records))
+            f.write(header.ljust(HeaderSize, b'\x00'))
+            f.write(b''.join(self.pack(r) for r in records))
+
+        self.f.close()
+        os.replace(tmp, self.path)
+        self.count = len(records)
+        self.f = open(self.path, "r+b")
+
+
+    def clear(self):
+        self.count = 0
+        self.cursor = (0, 0)
+        self.f.truncate(HeaderSize)
+        self.writeHeader()
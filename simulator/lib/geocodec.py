@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Fixed-point geolocation codec.
+#
+# x, y and z are quantized to multiples of 10^-digits and packed with
+# struct instead of being posted as "$x_y_z" float reprs. Contract
+# arguments go through neo-python as text, so the packed bytes are
+# base64 encoded behind a one character prefix:
+#
+#   "#" absolute: digits | seq | x | y | z (int32)   20 bytes
+#   "~" delta:    digits | seq | dx | dy | dz (int16) 12 bytes
+#
+# seq counts a vehicle's posts modulo 256. A delta is relative to the
+# post with seq - 1, so it is only decoded when that post was decoded;
+# the encoder sends an absolute frame every keyframeInterval posts, and
+# whenever a delta does not fit, to bound the records a receiver that
+# missed a post has to drop. Legacy "$x_y_z" strings are still decoded.
+#
+# Usage: ./geocodec.py  (round-trip checks and a comparison with "$x_y_z")
+
+import time
+import base64
+import struct
+import random
+
+Digits = 3
+KeyframeInterval = 16
+
+AbsolutePrefix = b"#"
+DeltaPrefix = b"~"
+Absolute = struct.Struct("<BB3i")
+Delta = struct.Struct("<BB3h")
+
+DeltaMax = 0x7fff
+
+
+def quantize(v, digits=Digits):
+    return int(round(float(v) * 10 ** digits))
+
+
+def isEncoded(data):
+    return data[:1] in (AbsolutePrefix, DeltaPrefix)
+
+
+def pack(prefix, frame):
+    return prefix + base64.urlsafe_b64encode(frame).rstrip(b"=")
+
+
+def unpack(data):
+    s = data[1:]
+    return base64.urlsafe_b64decode(s + b"=" * (-len(s) % 4))
+
+
+class Encoder:
+    # encodes the successive posts of one vehicle
+
+    def __init__(self, digits=Digits, delta=False, keyframeInterval=KeyframeInterval):
+        self.digits = digits
+        self.delta = delta
+        self.keyframeInterval = keyframeInterval
+        self.seq = 0
+        self.last = None
+
+
+    def reset(self):
+        # the next post is an absolute frame, e.g. after a failed post
+        self.last = None
+
+
+    def encode(self, x, y, z):
+        q = (quantize(x, self.digits), quantize(y, self.digits), quantize(z, self.digits))
+        self.seq = (self.seq + 1) % 256
+
+        last = self.last
+        self.last = q
+        if self.delta and last is not None and self.seq % self.keyframeInterval != 0:
+            d = [a - b for (a, b) in zip(q, last)]
+            if all(-DeltaMax <= v <= DeltaMax for v in d):
+                return pack(DeltaPrefix, Delta.pack(self.digits, self.seq, *d)).decode("ascii")
+
+        return pack(AbsolutePrefix, Absolute.pack(self.digits, self.seq, *q)).decode("ascii")
+
+
+class Decoder:
+    # decodes the posts of any number of vehicles, in posting order
+
+    def __init__(self):
+        self.vehicles = {}
+
+
+    def decode(self, vehicle, data):
+        # returns (x, y, z), or None for a delta whose base is unknown
+        if isinstance(data, str):
+            data = data.encode("ascii")
+
+        if data[:1] == AbsolutePrefix:
+            (digits, seq, qx, qy, qz) = Absolute.unpack(unpack(data))
+            q = (qx, qy, qz)
+        elif data[:1] == DeltaPrefix:
+            (digits, seq, dx, dy, dz) = Delta.unpack(unpack(data))
+            state = self.vehicles.get(vehicle)
+            if state is None or state[0] != (seq - 1) % 256:
+                return None
+            (_, (qx, qy, qz)) = state
+            q = (qx + dx, qy + dy, qz + dz)
+        else:
+            raise ValueError("Not an encoded geolocation: %r" % data)
+
+        # an older post read again must not move the state back
+        state = self.vehicles.get(vehicle)
+        if state is None or 0 < (seq - state[0]) % 256 < 128:
+            self.vehicles[vehicle] = (seq, q)
+
+        scale = 10 ** -digits
+        return (q[0] * scale, q[1] * scale, q[2] * scale)
+
+
+def legacyEncode(x, y, z):
+    return "$%s_%s_%s" % (x, y, z)
+
+
+def legacyDecode(data):
+    (x, y, z) = map(float, data.decode("UTF-8").replace("$", "").split("_"))
+    return (x, y, z)
+
+
+def test():
+    random.seed(1)
+    tolerance = 0.5 * 10 ** -Digits + 1e-9
+
+    # absolute frames round-trip within half a quantization step
+    encoder = Encoder()
+    decoder = Decoder()
+    for i in range(10000):
+        p = (random.uniform(-1e5, 1e5), random.uniform(-1e5, 1e5), random.uniform(-100, 100))
+        data = encoder.encode(*p)
+        assert len(data) == 20 and data[0] == "#"
+        q = decoder.decode("v", data)
+        assert all(abs(a - b) <= tolerance for (a, b) in zip(p, q)), (p, q)
+
+    # delta frames follow a moving vehicle, jumps fall back to absolute
+    encoder = Encoder(delta=True)
+    decoder = Decoder()
+    p = [0., 0., 0.]
+    sizes = set()
+    for i in range(1000):
+        p = [v + random.uniform(-2, 2) for v in p]
+        if i % 100 == 99:
+            p[0] += 1000
+        data = encoder.encode(*p)
+        sizes.add(len(data))
+        q = decoder.decode("v", data)
+        assert all(abs(a - b) <= tolerance for (a, b) in zip(p, q)), (i, p, q)
+    assert sizes == {12, 20}, sizes
+
+    # a missed post drops the deltas up to the next absolute frame
+    encoder = Encoder(delta=True, keyframeInterval=4)
+    decoder = Decoder()
+    frames = [encoder.encode(i, i, 0) for i in range(1, 10)]
+    decoded = [decoder.decode("v", f) for (i, f) in enumerate(frames) if i != 1]
+    assert decoded[:4] == [(1., 1., 0.), None, (4., 4., 0.), (5., 5., 0.)], decoded
+
+    # reading an older post again leaves the state alone
+    decoder = Decoder()
+    for f in frames[:5]:
+        decoder.decode("v", f)
+    assert decoder.decode("v", frames[3]) == (4., 4., 0.)
+    assert decoder.decode("v", frames[5]) == (6., 6., 0.)
+
+    # rounding of negative coordinates, legacy strings
+    (x, y, z) = Decoder().decode("v", Encoder().encode(-1.2345, -0.0004, -7))
+    assert abs(x + 1.2345) <= tolerance and y == 0 and z == -7
+    assert legacyDecode(legacyEncode(2.5, -3.25, 0).encode("UTF-8")) == (2.5, -3.25, 0.)
+    assert isEncoded(b"#AAA") and isEncoded(b"~AAA") and not isEncoded(b"$1_2_3")
+
+    print("Round-trip checks passed.")
+
+
+def benchmark(n=100000):
+    random.seed(2)
+    samples = []
+    p = [random.uniform(0, 1000), random.uniform(0, 1000), 0.]
+    for i in range(n):
+        p = [p[0] + random.uniform(-1, 1), p[1] + random.uniform(-1, 1), 0.]
+        samples.append(tuple(p))
+
+    rows = []
+
+    t = time.time()
+    legacy = [legacyEncode(*s).encode("UTF-8") for s in samples]
+    tEncode = time.time() - t
+    t = time.time()
+    for data in legacy:
+        legacyDecode(data)
+    tDecode = time.time() - t
+    rows.append(("$x_y_z", sum(map(len, legacy)) / n, tEncode, tDecode))
+
+    for delta in (False, True):
+        encoder = Encoder(delta=delta)
+        t = time.time()
+        encoded = [encoder.encode(*s).encode("ascii") for s in samples]
+        tEncode = time.time() - t
+        decoder = Decoder()
+        t = time.time()
+        for data in encoded:
+            decoder.decode("v", data)
+        tDecode = time.time() - t
+        rows.append(("delta" if delta else "absolute", sum(map(len, encoded)) / n, tEncode, tDecode))
+
+    print("%-10s %12s %14s %14s" % ("format", "bytes/post", "encode/s", "decode/s"))
+    for (name, size, tEncode, tDecode) in rows:
+        print("%-10s %12.1f %14.0f %14.0f" % (name, size, n / tEncode, n / tDecode))
+
+
+if __name__ == "__main__":
+    test()
+    benchmark()
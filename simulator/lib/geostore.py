@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Time-ordered, bounded store of received geolocations.
+#
+# Records are kept sorted by timestamp in a list with a parallel list of
+# timestamps, so `since` queries are a bisect. The oldest records are
+# dropped once the store exceeds its capacity or they get older than
+# maxAge seconds; dropped slots are skipped by a start offset and
+# compacted away in bulk. Records are also grouped per vehicle, and the
+# latest position of every vehicle is kept in a uniform grid of cellSize
+# cells for radius and bounding box queries.
+
+import math
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+
+class GeoStore:
+    def __init__(self, capacity=100000, maxAge=600., perVehicle=256, cellSize=16.):
+        self.capacity = capacity
+        self.maxAge = maxAge
+        self.perVehicle = perVehicle
+        self.cellSize = cellSize
+        self.clear()
+
+
+    def clear(self):
+        self.timestamps = []
+        self.records = []
+        self.start = 0
+        self.vehicles = {}
+        self.grid = {}
+        self.cells = {}
+
+
+    def __len__(self):
+        return len(self.records) - self.start
+
+
+    def add(self, record):
+        # returns False if the vehicle's record at this time is known
+        ts = record["timestamp"]
+        history = self.vehicles.get(record["receiver"])
+        if history is not None:
+            k = len(history)
+            while k > 0 and history[k - 1]["timestamp"] >= ts:
+                if history[k - 1]["timestamp"] == ts:
+                    return False
+                k -= 1
+
+        if len(self) == 0 or ts >= self.timestamps[-1]:
+            self.timestamps.append(ts)
+            self.records.append(record)
+        else:
+            i = bisect_right(self.timestamps, ts, self.start)
+            self.timestamps.insert(i, ts)
+            self.records.insert(i, record)
+
+        if history is None:
+            history = deque(maxlen=self.perVehicle)
+            self.vehicles[record["receiver"]] = history
+
+        if len(history) == 0 or ts >= history[-1]["timestamp"]:
+            history.append(record)
+            self.index(record)
+        else:
+            k = len(history)
+            while k > 0 and history[k - 1]["timestamp"] > ts:
+                k -= 1
+            if len(history) < self.perVehicle:
+                history.insert(k, record)
+
+        overflow = len(self) - self.capacity
+        if overflow > 0:
+            self.drop(self.start + overflow)
+
+        return True
+
+
+    def since(self, ts):
+        i = bisect_left(self.timestamps, ts, self.start)
+        return self.records[i:]
+
+
+    def vehicle(self, addr, since=None):
+        history = self.vehicles.get(addr, ())
+        if since is None:
+            return list(history)
+        return [r for r in history if r["timestamp"] >= since]
+
+
+    def latest(self):
+        return [history[-1] for history in self.vehicles.values()]
+
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cellSize)), int(math.floor(y / self.cellSize)))
+
+
+    def index(self, record):
+        # moves the vehicle to the cell of its latest position
+        addr = record["receiver"]
+        (x, y, z) = record["location"]
+        cell = self.cell(x, y)
+        old = self.cells.get(addr)
+        if old == cell:
+            return
+
+        if old is not None:
+            self.unindex(addr)
+        self.cells[addr] = cell
+        self.grid.setdefault(cell, set()).add(addr)
+
+
+    def unindex(self, addr):
+        cell = self.cells.pop(addr)
+        vehicles = self.grid[cell]
+        vehicles.discard(addr)
+        if len(vehicles) == 0:
+            del self.grid[cell]
+
+
+    def candidates(self, x0, y0, x1, y1):
+        # vehicles in the cells overlapping the box
+        (cx0, cy0) = self.cell(x0, y0)
+        (cx1, cy1) = self.cell(x1, y1)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.grid):
+            cells = [c for c in self.grid if cx0 <= c[0] <= cx1 and cy0 <= c[1] <= cy1]
+        else:
+            cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+
+        for c in cells:
+            for addr in self.grid.get(c, ()):
+                yield addr
+
+
+    def histories(self, addrs, since):
+        records = []
+        for addr in addrs:
+            records.extend(self.vehicle(addr, since))
+        records.sort(key=lambda r: r["timestamp"])
+        return records
+
+
+    def query(self, since=None, near=None, bbox=None):
+        # records of the vehicles whose latest position is within
+        # near = (x, y, radius) and inside bbox = (x0, y0, x1, y1)
+        if near is None and bbox is None:
+            return self.since(since or 0)
+
+        (x0, y0, x1, y1) = (-math.inf, -math.inf, math.inf, math.inf)
+        if bbox is not None:
+            (x0, y0, x1, y1) = bbox
+        if near is not None:
+            (cx, cy, radius) = near
+            (x0, y0) = (max(x0, cx - radius), max(y0, cy - radius))
+            (x1, y1) = (min(x1, cx + radius), min(y1, cy + radius))
+        if x0 > x1 or y0 > y1:
+            return []
+
+        addrs = []
+        for addr in self.candidates(x0, y0, x1, y1):
+            (x, y, z) = self.vehicles[addr][-1]["location"]
+            if not (x0 <= x <= x1 and y0 <= y <= y1):
+                continue
+            if near is not None and (x - cx) ** 2 + (y - cy) ** 2 > radius ** 2:
+                continue
+            addrs.append(addr)
+
+        return self.histories(addrs, since)
+
+
+    def evict(self, now):
+        cutoff = now - self.maxAge
+        i = bisect_left(self.timestamps, cutoff, self.start)
+        if i > self.start:
+            self.drop(i)
+
+
+    def drop(self, end):
+        for record in self.records[self.start:end]:
+            history = self.vehicles.get(record["receiver"])
+            if history is None:
+                continue
+
+            if len(history) > 0 and history[0] is record:
+                history.popleft()
+            if len(history) == 0:
+                del self.vehicles[record["receiver"]]
+                self.unindex(record["receiver"])
+
+        self.start = end
+
+        # compact once half of the list is dropped records
+        if self.start > len(self.records) // 2:
+            del self.timestamps[:self.start]
+            del self.records[:self.start]
+            self.start = 0
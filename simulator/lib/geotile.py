@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Coarse spatial tiles used by the contract's tile index.
+#
+# A tile is the Morton code (bit-interleaved x and y) of a position
+# quantized to TileSize units, so tiles of a coarser level share a
+# common prefix like geohashes do. Tile 0 is reserved for "no tile".
+
+import math
+
+TileSize = 16.0
+TileBits = 15
+
+
+def quantize(v, size=TileSize):
+    q = int(math.floor(v / size)) + (1 << (TileBits - 1))
+    return min(max(q, 0), (1 << TileBits) - 1)
+
+
+def interleave(qx, qy):
+    code = 0
+    for i in range(TileBits):
+        code |= ((qx >> i) & 1) << (2 * i)
+        code |= ((qy >> i) & 1) << (2 * i + 1)
+    return code
+
+
+def tileOf(x, y, size=TileSize):
+    return interleave(quantize(x, size), quantize(y, size)) + 1
+
+
+def tilesAround(x, y, radius, size=TileSize):
+    (qx0, qx1) = (quantize(x - radius, size), quantize(x + radius, size))
+    (qy0, qy1) = (quantize(y - radius, size), quantize(y + radius, size))
+
+    tiles = []
+    for qx in range(qx0, qx1 + 1):
+        for qy in range(qy0, qy1 + 1):
+            tiles.append(interleave(qx, qy) + 1)
+
+    return tiles
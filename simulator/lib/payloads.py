@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Decoding of the [timestamp, script hash, geolocation] payloads notified
+# by the NRC contract into geolocation records.
+#
+# A few vehicles post over and over, so the script hash to address
+# conversion (double SHA-256 and base58) is memoized in a bounded LRU
+# cache. Geolocations encoded with geocodec are decoded by a Decoder
+# that follows each vehicle's posts, legacy "$x_y_z" ones are parsed
+# from the raw bytes.
+#
+# Usage: ./payloads.py [nRecords] [nVehicles]  (microbenchmark)
+
+import sys
+import time
+import struct
+import binascii
+import hashlib
+from functools import lru_cache
+from base58 import b58encode
+
+import geocodec
+
+AddressCacheSize = 4096
+
+
+@lru_cache(maxsize=AddressCacheSize)
+def scriptHashToAddr(h, version):
+    d = bytes([version]) + h
+    checksum = hashlib.sha256(hashlib.sha256(d).digest()).digest()[:4]
+    return b58encode(d + checksum)
+
+
+def decodeTimestamp(ts):
+    # milliseconds as a little-endian VM integer
+    return int.from_bytes(ts, "little") / 1000.
+
+
+def decodeGeolocation(geo):
+    if geo[:1] == b"$":
+        geo = geo[1:]
+    (x, y, z) = geo.split(b"_")
+    return (float(x), float(y), float(z))
+
+
+def decode(payload, version, decoder):
+    # returns None if the geolocation cannot be decoded yet
+    [ts, sh, geo] = payload
+    receiver = scriptHashToAddr(bytes(sh), version)
+    geo = bytes(geo)
+    if geocodec.isEncoded(geo):
+        location = decoder.decode(receiver, geo)
+        if location is None:
+            return None
+    else:
+        location = decodeGeolocation(geo)
+
+    return {
+        "timestamp": decodeTimestamp(ts),
+        "receiver": receiver,
+        "location": location
+    }
+
+
+def decodeAll(payloads, version, decoder=None):
+    # payloads in posting order, pass the same decoder along for deltas
+    if decoder is None:
+        decoder = geocodec.Decoder()
+
+    # a malformed payload is skipped, not the whole batch
+    records = []
+    for payload in payloads:
+        try:
+            record = decode(payload, version, decoder)
+        except (ValueError, struct.error, binascii.Error) as e:
+            print("Skipping malformed geolocation: %s" % e)
+            continue
+
+        if record is not None:
+            records.append(record)
+
+    return records
+
+
+def legacyDecode(payload, version):
+    # the per-record decoding NRCReceiver.addGeo used before
+    [ts, sh, geo] = payload
+    bytes8 = ts + b'\x00' * (8 - len(ts))
+    ts = struct.unpack('Q', bytes8)[0] / 1000.
+    d = chr(version).encode("UTF-8") + sh
+    checksum = hashlib.sha256(hashlib.sha256(d).digest()).digest()[:4]
+    receiver = b58encode(d + checksum)
+    (x, y, z) = map(float, geo.decode("UTF-8").replace("$", "").split("_"))
+    return {
+        "timestamp": ts,
+        "receiver": receiver,
+        "location": (x, y, z)
+    }
+
+
+def benchmark(nRecords=100000, nVehicles=50, version=23):
+    vehicles = [hashlib.sha256(b"%d" % i).digest()[:20] for i in range(nVehicles)]
+    payloads = []
+    for i in range(nRecords):
+        ts = (1525000000000 + i).to_bytes(6, "little")
+        geo = ("$%s_%s_%s" % (i % 97 * 0.5, i % 89 * 0.25, 0)).encode("UTF-8")
+        payloads.append([ts, vehicles[i % nVehicles], geo])
+
+    t = time.time()
+    before = [legacyDecode(p, version) for p in payloads]
+    tBefore = time.time() - t
+
+    scriptHashToAddr.cache_clear()
+    t = time.time()
+    after = decodeAll(payloads, version)
+    tAfter = time.time() - t
+
+    assert before == after
+    print("%s records from %s vehicles" % (nRecords, nVehicles))
+    print("before: %10.0f records/s" % (nRecords / tBefore))
+    print("after:  %10.0f records/s" % (nRecords / tAfter))
+    print("address cache: %s" % (scriptHashToAddr.cache_info(), ))
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    benchmark(*args)
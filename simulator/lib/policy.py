@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Dead-reckoning posting policy.
+#
+# Receivers extrapolate a vehicle from its last two posted geolocations
+# at constant velocity (see willCollide() in simulator.py). The sender
+# runs the same model over what it has posted and only posts a sample
+# once the prediction is more than `threshold` away from it, or when
+# nothing was posted for `maxInterval` seconds, so receivers' error stays
+# bounded by the threshold while a predictable vehicle posts rarely.
+
+import math
+
+
+class DeadReckoning:
+    def __init__(self, threshold=0.5, maxInterval=30.):
+        self.threshold = threshold
+        self.maxInterval = maxInterval
+        self.posts = []
+        self.offered = 0
+        self.accepted = 0
+
+
+    def predict(self, t):
+        # where receivers expect the vehicle at time t
+        if len(self.posts) == 0:
+            return None
+
+        (t1, x1, y1) = self.posts[-1]
+        if len(self.posts) == 1:
+            return (x1, y1)
+
+        (t0, x0, y0) = self.posts[0]
+        if t1 == t0:
+            return (x1, y1)
+
+        dx = (x1 - x0) / (t1 - t0)
+        dy = (y1 - y0) / (t1 - t0)
+        return (x1 + dx * (t - t1), y1 + dy * (t - t1))
+
+
+    def error(self, t, x, y):
+        predicted = self.predict(t)
+        if predicted is None:
+            return math.inf
+
+        (px, py) = predicted
+        return math.sqrt((x - px) ** 2 + (y - py) ** 2)
+
+
+    def offer(self, t, x, y):
+        # returns True if the sample should be posted
+        self.offered += 1
+        if len(self.posts) > 0 and t - self.posts[-1][0] < self.maxInterval:
+            if self.error(t, x, y) <= self.threshold:
+                return False
+
+        self.posts = self.posts[-1:] + [(t, x, y)]
+        self.accepted += 1
+        return True
+
+
+    def reset(self):
+        # an accepted sample was not posted after all, receivers' model
+        # is unknown so the next sample is posted
+        self.posts = []
+
+
+    def getStats(self):
+        return {
+            "offered": self.offered,
+            "accepted": self.accepted
+        }
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Incremental wallet synchronization.
+#
+# Wallet.Rebuild() forgets every coin and rescans the chain from genesis.
+# After a request the wallet only needs the blocks persisted since its
+# last processed height, which Wallet.ProcessBlocks() applies. It runs on
+# the reactor thread, like the wallet's own LoopingCall, so the two never
+# process blocks concurrently.
+
+from twisted.internet import reactor, threads
+from neo.Core.Blockchain import Blockchain
+
+
+class WalletSync:
+    def __init__(self, wallet):
+        self.wallet = wallet
+        self.height = wallet.WalletHeight
+
+
+    def sync(self):
+        # blocks until the wallet has processed every persisted block
+        while self.wallet.WalletHeight <= Blockchain.Default().Height:
+            threads.blockingCallFromThread(reactor, self.wallet.ProcessBlocks)
+
+        n = self.wallet.WalletHeight - self.height
+        self.height = self.wallet.WalletHeight
+        return n
+
+
+    def rebuild(self):
+        # recovery only: rescans the whole chain
+        threads.blockingCallFromThread(reactor, self.wallet.Rebuild)
+        self.height = self.wallet.WalletHeight
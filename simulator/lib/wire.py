@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Framed wire protocol between the simulator and the NRC nodes.
+#
+# Every message is a frame: a 4-byte big-endian payload length, a 1-byte
+# kind and the payload, so messages of any size are read completely.
+# JSON frames carry requests and responses, geolocation frames carry a
+# list of records packed as
+#
+#   timestamp | x | y | z (big-endian doubles) | n | receiver (n bytes)
+#
+# Peers that send a bare JSON object instead of a frame are served in
+# that format, which is detected by the object's leading "{".
+
+import json
+import struct
+
+KindJSON = 0
+KindGeolocations = 1
+
+Header = struct.Struct("!IB")
+Record = struct.Struct("!4dB")
+MaxFrameSize = 64 * 1024 * 1024
+
+
+def encodeGeolocations(records):
+    chunks = []
+    for r in records:
+        (x, y, z) = r["location"]
+        receiver = r["receiver"]
+        if isinstance(receiver, str):
+            receiver = receiver.encode("UTF-8")
+        chunks.append(Record.pack(r["timestamp"], x, y, z, len(receiver)))
+        chunks.append(receiver)
+
+    return b''.join(chunks)
+
+
+def decodeGeolocations(payload):
+    records = []
+    i = 0
+    while i < len(payload):
+        (ts, x, y, z, n) = Record.unpack_from(payload, i)
+        i += Record.size
+        records.append({
+            "timestamp": ts,
+            "receiver": payload[i:i + n].decode("UTF-8"),
+            "location": (x, y, z)
+        })
+        i += n
+
+    return records
+
+
+def frame(kind, payload):
+    return Header.pack(len(payload), kind) + payload
+
+
+def encode(obj):
+    # lists of geolocation records are packed, anything else is JSON
+    if isinstance(obj, list):
+        return frame(KindGeolocations, encodeGeolocations(obj))
+    return frame(KindJSON, json.dumps(obj).encode("UTF-8"))
+
+
+def decode(kind, payload):
+    if kind == KindJSON:
+        return json.loads(payload.decode("UTF-8"))
+    if kind == KindGeolocations:
+        return decodeGeolocations(payload)
+    raise ValueError("Unknown frame kind: %s" % kind)
+
+
+def parseHeader(header):
+    (length, kind) = Header.unpack(header)
+    if length > MaxFrameSize:
+        raise ValueError("Frame too large: %s bytes" % length)
+    return (length, kind)
+
+
+def parseLegacy(data):
+    # returns None until the whole JSON object has been read
+    if len(data) > MaxFrameSize:
+        raise ValueError("Request too large: %s bytes" % len(data))
+    try:
+        return json.loads(data.decode("UTF-8"))
+    except ValueError:
+        return None
+
+
+# Blocking sockets
+
+def recvExact(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 65536))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def send(sock, obj):
+    sock.sendall(encode(obj))
+
+
+def recv(sock):
+    # returns None once the peer has closed the connection
+    first = sock.recv(1)
+    if not first:
+        return None
+
+    (length, kind) = parseHeader(first + recvExact(sock, Header.size - 1))
+    return decode(kind, recvExact(sock, length))
+
+
+def recvRequest(sock):
+    # returns (request, framed), framed is False for a bare JSON peer
+    first = recvExact(sock, 1)
+    if first != b"{":
+        (length, kind) = parseHeader(first + recvExact(sock, Header.size - 1))
+        return (decode(kind, recvExact(sock, length)), True)
+
+    data = first
+    while True:
+        request = parseLegacy(data)
+        if request is not None:
+            return (request, False)
+
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ValueError("Incomplete JSON request")
+        data += chunk
+
+
+# asyncio streams
+
+async def read(reader):
+    (length, kind) = parseHeader(await reader.readexactly(Header.size))
+    return decode(kind, await reader.readexactly(length))
+
+
+async def readRequest(reader):
+    # returns (request, framed), framed is False for a bare JSON peer
+    first = await reader.readexactly(1)
+    if first != b"{":
+        (length, kind) = parseHeader(first + await reader.readexactly(Header.size - 1))
+        return (decode(kind, await reader.readexactly(length)), True)
+
+    data = first
+    while True:
+        request = parseLegacy(data)
+        if request is not None:
+            return (request, False)
+
+        chunk = await reader.read(4096)
+        if not chunk:
+            raise ValueError("Incomplete JSON request")
+        data += chunk
@@ -4,15 +4,26 @@ import os
 import sys
 import time
 import math
-import json
 import pygame
 from socket import *
-from threading import Thread
+from threading import Thread, Lock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+import wire
 
 # Settings
 GridWidth = 32
 GridHeight = 32
 
+# only vehicles within this distance of the receiver's path are received
+WatchMargin = 16
+
+# seconds of received geolocations kept for the collision check
+HistorySeconds = 300
+
+# seconds between the sender's samples, the NRC sender decides which to post
+SampleInterval = 1
+
 addr_sender = ("127.0.0.1", 35001)
 addr_receiver = ("127.0.0.1", 35002)
 
@@ -21,13 +32,12 @@ def postGeolocation(timestamp, x, y, z):
     print("Posting (%s, %s, %s) at %s..." % (x, y, z, timestamp))
     s = socket(AF_INET, SOCK_STREAM)
     s.connect(addr_sender)
-    msg = json.dumps({
+    wire.send(s, {
         "timestamp": timestamp, 
         "x": x,
         "y": y,
         "z": z
-    }).encode("UTF-8")
-    s.send(msg)
+    })
     s.close()
 
 
@@ -36,41 +46,46 @@ def requestTicket():
     print("Requesting ticket...")
     s = socket(AF_INET, SOCK_STREAM)
     s.connect(addr_receiver)
-    msg = json.dumps({
+    wire.send(s, {
         "method": "requestTicket",
         "nBlocks": 500
-    }).encode("UTF-8")
-    s.send(msg)
+    })
 
-    data = s.recv(1024).decode("UTF-8")
-    s.close()
     try:
-        ok = json.loads(data)["ok"]
+        ok = wire.recv(s)["ok"]
     except:
         print("Invalid data!")
         return False
+    finally:
+        s.close()
 
     return True
 
 
-def requestGeolocations():
+def subscribeGeolocations(onGeolocation, since, bbox=None):
     s = socket(AF_INET, SOCK_STREAM)
     s.connect(addr_receiver)
-    msg = json.dumps({
-        "method": "requestGeolocations",
-        "since": time.time() - 300
-    }).encode("UTF-8")
-    s.send(msg)
+    wire.send(s, {
+        "method": "subscribe",
+        "since": since,
+        "bbox": bbox
+    })
 
-    data = s.recv(40960).decode("UTF-8")
-    s.close()
-    try:
-        geolocations = json.loads(data)
-    except:
-        print("Invalid data!")
-        return []
+    # the receiver pushes the geolocations as they are ingested
+    while True:
+        try:
+            geolocations = wire.recv(s)
+        except:
+            print("Invalid data!")
+            break
 
-    return geolocations
+        if geolocations is None:
+            break
+
+        for geolocation in geolocations:
+            onGeolocation(geolocation)
+
+    s.close()
 
 
 def loadMap(path):
@@ -221,7 +236,6 @@ pygame.display.set_caption('NRC Demo: See Through The Wall')
 clock = pygame.time.Clock()
 
 tStartSender = tStartReceiver = time.time()
-lastUpdatedTime = -1
 
 # Purchase a ticket for receiver
 if not requestTicket():
@@ -243,7 +257,7 @@ def senderAction():
         locSender = interpolate(locSender0, locDestination, alpha)
         (x, y) = locSender
 
-        if timestamp - t0 > 30:
+        if timestamp - t0 > SampleInterval:
             t0 = timestamp
             postGeolocation(timestamp, x, y, 0)
 
@@ -254,6 +268,35 @@ tS = Thread(target=senderAction)
 tS.daemon = True
 tS.start()
 
+# Subscribe to the geolocations received by the receiver
+receivedGeolocations = []
+newGeolocations = False
+geolocationsLock = Lock()
+
+def onGeolocation(geolocation):
+    global newGeolocations
+
+    with geolocationsLock:
+        receivedGeolocations.append(geolocation)
+        newGeolocations = True
+
+        # records arrive about in time order, drop the expired ones
+        cutoff = time.time() - HistorySeconds
+        i = 0
+        while i < len(receivedGeolocations) and receivedGeolocations[i]["timestamp"] < cutoff:
+            i += 1
+        del receivedGeolocations[:i]
+
+
+(xr0, yr0) = locReceiver0
+(xd, yd) = locDestination
+watchBox = [min(xr0, xd) - WatchMargin, min(yr0, yd) - WatchMargin,
+            max(xr0, xd) + WatchMargin, max(yr0, yd) + WatchMargin]
+
+tR = Thread(target=subscribeGeolocations, args=(onGeolocation, time.time() - HistorySeconds, watchBox))
+tR.daemon = True
+tR.start()
+
 Quit = False
 while True:
     for event in pygame.event.get():
@@ -265,9 +308,11 @@ while True:
         break
 
     t = time.time()
-    if t - lastUpdatedTime > 30:
-        lastUpdatedTime = t
-        geos = requestGeolocations()
+    if newGeolocations:
+        with geolocationsLock:
+            geos = [g for g in receivedGeolocations if g["timestamp"] >= t - HistorySeconds]
+            newGeolocations = False
+
         if len(geos) > 0:
             print(geos)
 